@@ -1,12 +1,16 @@
+from globals import *
+
+import asyncio
+
 from agent.web_rtc import WebRTCClient
-from asyncio import sleep
 
 
-async def run(name: str = "Agent", interview_room: str = "test-room"):
-    """Runs AI agent on the backend socket."""
-    sleep(5) # Wait for first peer to connect
+async def run(name: str = AGENT_NAME, interview_room: str = "test-room"):
+    """Runs AI agent on the backend socket until it is cancelled."""
+
     client = await WebRTCClient.connect_to_socket(name, interview_room)
-    # await client.create_offer()
-    while True:
-        await sleep(1)
-    # await client.close()
+    try:
+        await asyncio.Event().wait()  # agent reconnects by itself, so it just lives until it is cancelled
+    finally:
+        await client.close()
+        await WebRTCClient.close_http_session()
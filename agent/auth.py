@@ -0,0 +1,37 @@
+from globals import *
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+AGENT_TOKEN_MAX_AGE: int = 60  # seconds, agents sign a fresh token for every connection
+
+_serializer = URLSafeTimedSerializer(SECRETS["FLASK_SECRET_KEY"], salt="agent-token")
+
+
+def sign_agent_token(interview_room: str, name: str) -> str:
+    """
+    Signs token that lets agent join the interview room directly through the socket
+    (without passing the checkpoint form).
+
+    :param interview_room: Name of the interview room
+    :param name: Display name of the agent
+
+    :return: Token that is signed with the secret key of the backend
+    """
+
+    return _serializer.dumps({"interview_room": interview_room, "name": name})
+
+
+def load_agent_token(token: str, max_age: int = AGENT_TOKEN_MAX_AGE) -> dict | None:
+    """
+    Verifies token of the agent.
+
+    :param token: Token of the agent
+    :param max_age: Maximum age of the token in seconds
+
+    :return: Dictionary with `interview_room` and `name` or `None` if token is invalid or expired
+    """
+
+    try:
+        return _serializer.loads(token, max_age=max_age)
+    except BadSignature:
+        return None
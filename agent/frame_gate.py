@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+
+
+class FrameGate:
+    """
+    Stage of the video pipeline that decides which frames are worth analyzing.
+
+    Base gate lets every frame through, subclasses implement `should_analyze`.
+    Gate counts how many frames were skipped and how many were analyzed.
+    """
+
+    def __init__(self):
+        self.analyzed_count = 0
+        self.skipped_count = 0
+
+    def should_analyze(self, y_plane: np.ndarray, timestamp: float) -> bool:
+        return True
+
+    def check(self, y_plane: np.ndarray, timestamp: float) -> bool:
+        """
+        Decides whether frame should be analyzed.
+
+        :param y_plane: Luma (Y) plane of the frame
+        :param timestamp: Time of the frame in seconds
+
+        :returns: Whether frame should be analyzed.
+        """
+
+        if self.should_analyze(y_plane, timestamp):
+            self.analyzed_count += 1
+            return True
+        self.skipped_count += 1
+        return False
+
+    def report(self) -> dict[str, int]:
+        return {"analyzed": self.analyzed_count, "skipped": self.skipped_count}
+
+
+class AdaptiveFrameGate(FrameGate):
+    """
+    Adaptive sampling of the video based on cheap change detection.
+
+    Every frame is downscaled to a tiny thumbnail of its Y plane.
+    Frame is skipped if it is nearly identical to the last analyzed one,
+    and sampling interval shrinks to `min_interval` when motion between consecutive frames spikes,
+    growing back to `max_interval` while the picture stays calm.
+    Frame is analyzed at least once per `max_interval` regardless of changes.
+    """
+
+    def __init__(self,
+                 min_interval: float = 0.2, max_interval: float = 5.0,
+                 change_threshold: float = 4.0, motion_threshold: float = 12.0,
+                 thumbnail_size: (int, int) = (32, 32)):
+        super().__init__()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.change_threshold = change_threshold  # mean absolute difference of thumbnails (0-255)
+        self.motion_threshold = motion_threshold
+        self.thumbnail_size = thumbnail_size
+
+        self.interval = max_interval
+        self.last_analyzed_time = None
+        self.reference = None  # thumbnail of the last analyzed frame
+        self.previous = None  # thumbnail of the previous frame
+
+    def thumbnail(self, y_plane: np.ndarray) -> np.ndarray:
+        return cv2.resize(y_plane, self.thumbnail_size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def should_analyze(self, y_plane: np.ndarray, timestamp: float) -> bool:
+        thumbnail = self.thumbnail(y_plane)
+
+        if self.previous is not None:
+            motion = np.abs(thumbnail - self.previous).mean()
+            if motion >= self.motion_threshold:
+                self.interval = self.min_interval
+        self.previous = thumbnail
+
+        if self.reference is None:
+            return self.__accept(thumbnail, timestamp)
+
+        elapsed = timestamp - self.last_analyzed_time
+        if elapsed >= self.max_interval:
+            return self.__accept(thumbnail, timestamp)
+        if elapsed < self.interval:
+            return False
+        if np.abs(thumbnail - self.reference).mean() < self.change_threshold:
+            return False
+        return self.__accept(thumbnail, timestamp)
+
+    def __accept(self, thumbnail: np.ndarray, timestamp: float) -> bool:
+        self.reference = thumbnail
+        self.last_analyzed_time = timestamp
+        self.interval = min(self.interval * 2, self.max_interval)  # calming down after the spike
+        return True
@@ -0,0 +1,82 @@
+import av
+import numpy as np
+
+
+class FrameAdapter:
+    """
+    Adapter of the decoded video frame that is shared by every analyzer of the frame.
+
+    Planes of the frame are exposed as NumPy views without copying,
+    so detectors that only need luma (e.g. change detection) never convert the frame.
+    Color conversions are done by libswscale together with scaling to the resolution
+    requested by the consumer, and are cached, so several analyzers share one conversion.
+    """
+
+    def __init__(self, frame: av.VideoFrame):
+        if frame.format.name != "yuv420p":
+            frame = frame.reformat(format="yuv420p")
+        self.frame = frame
+        self.width = frame.width
+        self.height = frame.height
+
+        self.__cache = dict()
+
+    def plane(self, index: int) -> np.ndarray:
+        """
+        Returns plane of the frame as a view of the frame buffer (without padding of lines).
+
+        :param index: Index of the plane (0 - Y, 1 - U, 2 - V)
+        """
+
+        plane = self.frame.planes[index]
+        buffer = np.frombuffer(plane, dtype=np.uint8)
+        return buffer.reshape(-1, plane.line_size)[:plane.height, :plane.width]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.plane(0)
+
+    def size(self, max_side: int = None) -> (int, int):
+        """
+        Returns size of the frame scaled so that its longest side is not bigger than `max_side`.
+
+        :param max_side: Maximum length of the longest side (original size if not given)
+        """
+
+        if max_side is None or max(self.width, self.height) <= max_side:
+            return self.width, self.height
+        scale = max_side / max(self.width, self.height)
+        return max(int(self.width * scale) // 2 * 2, 2), max(int(self.height * scale) // 2 * 2, 2)
+
+    def convert(self, format: str, max_side: int = None) -> np.ndarray:
+        """
+        Converts frame to the given pixel format and resolution (result is cached).
+
+        :param format: Pixel format (e.g. `bgr24`, `rgb24` or `gray`)
+        :param max_side: Maximum length of the longest side of the result
+
+        :returns: Converted frame.
+        """
+
+        width, height = self.size(max_side)
+        key = (format, width, height)
+        if key not in self.__cache:
+            self.__cache[key] = self.frame.reformat(width=width, height=height, format=format).to_ndarray()
+        return self.__cache[key]
+
+    def bgr(self, max_side: int = None) -> np.ndarray:
+        """Frame in BGR (expected by OpenCV and YOLO)."""
+
+        return self.convert("bgr24", max_side)
+
+    def rgb(self, max_side: int = None) -> np.ndarray:
+        """Frame in RGB (expected by MediaPipe)."""
+
+        return self.convert("rgb24", max_side)
+
+    def gray(self, max_side: int = None) -> np.ndarray:
+        """Luma of the frame (view of the Y plane if resolution is not changed)."""
+
+        if self.size(max_side) == (self.width, self.height):
+            return self.y
+        return self.convert("gray", max_side)
@@ -0,0 +1,104 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FramePipeline:
+    """
+    Pipeline that processes video frames in a bounded thread pool instead of the event loop.
+
+    Every source (e.g. peer) has at most one frame in processing and one frame waiting for it.
+    If a newer frame arrives while one is already waiting, the waiting (oldest) frame is dropped,
+    so slow processing never builds up a backlog and only the latest frame of each peer is processed.
+    Results are delivered back to the event loop through callbacks.
+
+    Pipeline should only be used from the thread that runs its event loop
+    (agents of the process share one pipeline, see `agent.web_rtc.frame_pipeline`).
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="frame-pipeline")
+
+        self.closed = False
+
+        self.submitted_count = 0
+        self.processed_count = 0
+        self.dropped_count = 0
+
+        self.__in_flight = set()
+        self.__pending = dict()
+        self.__waiters: dict = dict()  # source -> futures that wait until the source has no frames in processing
+
+    def submit(self, source, function, *args, callback=None) -> None:
+        """
+        Schedules processing of the frame.
+
+        :param source: Source of the frame (frames of one source are processed one at a time)
+        :param function: Function that processes frame in the worker thread
+        :param args: Arguments of the function
+        :param callback: Function that receives result on the event loop (could be a coroutine function)
+        """
+
+        if self.closed:
+            return
+
+        self.submitted_count += 1
+        if source in self.__in_flight:
+            if source in self.__pending:
+                self.dropped_count += 1
+            self.__pending[source] = (function, args, callback)
+            return
+        self.__start(source, function, args, callback)
+
+    def report(self) -> dict[str, int]:
+        return {
+            "submitted": self.submitted_count,
+            "processed": self.processed_count,
+            "dropped": self.dropped_count,
+        }
+
+    async def release(self, source) -> None:
+        """
+        Drops waiting frame of the source and waits until its frame in processing is done,
+        so state that is used by processing of the source (e.g. its models) could be released after that.
+
+        :param source: Source of the frames (it should not submit new frames)
+        """
+
+        self.__pending.pop(source, None)
+        if source in self.__in_flight:
+            waiter = asyncio.get_running_loop().create_future()
+            self.__waiters.setdefault(source, []).append(waiter)
+            await waiter
+
+    def close(self) -> None:
+        """Drops all waiting frames and stops worker threads."""
+
+        self.closed = True
+        self.__pending.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __start(self, source, function, args, callback) -> None:
+        self.__in_flight.add(source)
+        future = asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        future.add_done_callback(lambda f: self.__finish(source, f, callback))
+
+    def __finish(self, source, future: asyncio.Future, callback) -> None:
+        self.__in_flight.discard(source)
+        if future.cancelled():
+            pass
+        elif future.exception() is not None:
+            print(f"Frame of {source} was not processed: {future.exception()!r}")
+        else:
+            self.processed_count += 1
+            if callback is not None:
+                result = callback(future.result())
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+
+        if source in self.__pending and not self.closed:
+            function, args, callback = self.__pending.pop(source)
+            self.__start(source, function, args, callback)
+            return
+        for waiter in self.__waiters.pop(source, []):
+            if not waiter.done():
+                waiter.set_result(None)
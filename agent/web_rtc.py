@@ -1,21 +1,90 @@
 from globals import *
 
+import asyncio
+import random
+
 import aiohttp
+import socketio
 from socketio import AsyncClient
-from aiortc import RTCIceCandidate, RTCPeerConnection, RTCSessionDescription, RTCIceServer, RTCConfiguration
+from aiortc import (RTCIceCandidate, RTCPeerConnection, RTCSessionDescription, RTCIceServer, RTCConfiguration,
+                    RTCBundlePolicy)
+from aiortc.contrib.media import MediaRelay
+from aiortc.mediastreams import MediaStreamError
 import cv2
+import threading
 import time
-from PIL import Image
 
-# from ai.proctoring import Proctor
-# proctor = Proctor()
+from agent.auth import sign_agent_token
+from agent.frame_gate import FrameGate, AdaptiveFrameGate
+from agent.frames import FrameAdapter
+from agent.pipeline import FramePipeline
+
+_pipeline = None  # frames of all interview rooms of the process are processed by one pool (see `frame_pipeline`)
+_batchers: dict = dict()  # profile -> proctoring shared by the interview rooms of the process (see `proctoring_batcher`)
+_batcher_lock = threading.Lock()
+_proctoring_failed: set = set()  # profiles whose models could not be loaded
+
+
+def frame_pipeline() -> FramePipeline:
+    """
+    Returns `FramePipeline` that is shared by all agents of the process, creating it on the first call.
+
+    Agents of the process run on one event loop (see `AgentWorker`),
+    so the number of frame processing threads does not grow with the number of rooms.
+    """
+
+    global _pipeline
+    if _pipeline is None or _pipeline.closed:
+        _pipeline = FramePipeline()
+    return _pipeline
+
+
+def close_frame_pipeline() -> None:
+    """Stops threads of the shared pipeline (agents of the process should be closed first)."""
+
+    global _pipeline
+    if _pipeline is not None:
+        _pipeline.close()
+        _pipeline = None
+
+
+def proctoring_batcher(profile: str = None):
+    """
+    Returns `ProctorBatcher` of the proctoring profile that is shared by all agents of the process,
+    creating it on the first call (rooms with the same profile share one batch).
+
+    :param profile: Proctoring profile of the room like `small:480` (see `ProctoringProfile.from_string`),
+                    profile of the deployment by default
+
+    :returns: Shared batcher or `None` if proctoring is disabled (see `PROCTORING`)
+              or the profile is invalid or its models could not be loaded.
+    """
+
+    if not PROCTORING or profile in _proctoring_failed:
+        return None
+    with _batcher_lock:
+        if profile not in _batchers and profile not in _proctoring_failed:
+            try:
+                # agent without proctoring needs no models
+                from ai.proctoring import Proctor, ProctorBatcher, ProctoringProfile
+
+                _batchers[profile] = ProctorBatcher(Proctor(ProctoringProfile.from_string(profile) if profile else None))
+            except Exception as e:
+                print(f"Прокторинг с профилем {profile or 'по умолчанию'} отключён, не удалось загрузить модели: {e!r}")
+                _proctoring_failed.add(profile)
+        return _batchers.get(profile)
+
 
 class P2PConnection:
     """
     Connection between AI agent and peer.
+
+    In SFU mode peer sends its audio and video only to the agent,
+    and the agent forwards tracks of other peers through the same connection
+    (every offer maps `mid` of the forwarded transceivers to ids of their peers).
     """
 
-    CONFIGURATION = RTCConfiguration(iceServers=[
+    ICE_SERVERS = [
         RTCIceServer(urls=[
             "stun:stun.l.google.com:19302",
             "stun:stun1.l.google.com:19302",
@@ -23,40 +92,137 @@ class P2PConnection:
             "stun:stun3.l.google.com:19302",
             "stun:stun4.l.google.com:19302"
         ])
-    ])
+    ]
+    CONFIGURATION = RTCConfiguration(iceServers=ICE_SERVERS)
+    # all forwarded tracks share one transport (aiortc does not bundle extra transceivers of the same kind otherwise)
+    SFU_CONFIGURATION = RTCConfiguration(iceServers=ICE_SERVERS, bundlePolicy=RTCBundlePolicy.MAX_BUNDLE)
 
-    def __init__(self, client: 'WebRTCClient', peer_id: int, configuration: RTCConfiguration = None):
+    def __init__(self, client: 'WebRTCClient', peer_id: int, configuration: RTCConfiguration = None,
+                 frame_gate: FrameGate = None):
         self.client = client
         self.peer_id = peer_id
+        self.source = (client.interview_room, peer_id)  # frames of the peer in the shared pipeline
+        self.frame_gate = frame_gate or AdaptiveFrameGate()
+        self.closed = False
+
+        # state of the proctoring of the peer (models are created in the pipeline, see `__process_frame`)
+        self.tracker = None
+        self.gaze_estimator = None
 
-        self.connection = RTCPeerConnection(configuration=configuration or P2PConnection.CONFIGURATION)
+        if configuration is None:
+            configuration = P2PConnection.SFU_CONFIGURATION if client.mode == "sfu" else P2PConnection.CONFIGURATION
+        self.connection = RTCPeerConnection(configuration=configuration)
+        if client.mode == "sfu":
+            self.connection.addTransceiver("audio", "recvonly")
         self.connection.addTransceiver("video", "recvonly")
-        self.connection.on("track", P2PConnection.__on_track)
+        self.connection.on("track", self.__on_track)
 
-    @staticmethod
-    async def __on_track(track):
+        self.forwarded: dict = dict()  # sender -> id of the peer whose track it forwards (SFU mode)
+        self.__negotiating = False  # whether offer was sent, but answer was not received yet
+        self.__renegotiate = False  # whether tracks were changed while the offer was in flight
+
+    async def __on_track(self, track):
         print(f"Received track: {track}")
+        if self.client.mode == "sfu":
+            await self.client.forward(self.peer_id, track)
+
+        # stream is decoded once, and relay shares its frames between the proctoring and forwarded copies
+        tap = self.client.relay.subscribe(track, buffered=False)
+        while True:
+            try:
+                frame = await tap.recv()
+            except MediaStreamError:
+                break
+            if track.kind == "video" and not self.closed:
+                # Everything heavier than receiving the frame is done outside of the event loop
+                frame_pipeline().submit(self.source, self.__process_frame, frame, callback=self.__show_frame)
         if track.kind == "video":
-            # last_sent_time = 0
-            # send_interval = 5
+            print(f"Video of peer {self.peer_id} is finished: {self.frame_gate.report()}")
+
+    def __process_frame(self, frame):
+        """Processes video frame in the worker thread of the pipeline."""
+
+        frame = FrameAdapter(frame)  # every analyzer shares conversions of the frame
+        timestamp = frame.frame.time if frame.frame.time is not None else time.time()
+
+        batcher = proctoring_batcher(self.client.proctoring_profile)
+        if batcher is not None and self.frame_gate.check(frame.y, timestamp):
+            if self.tracker is None:
+                from ai.proctoring import GazeEstimator, SuspicionTracker
+
+                self.tracker = SuspicionTracker(on_event=self.__on_suspicion)
+                self.gaze_estimator = GazeEstimator()
+            imgsz = batcher.proctor.profile.imgsz  # frames are resized once for the models of the profile
+            gaze = self.gaze_estimator.estimate(frame.rgb(imgsz))
+            # waiting keeps at most one frame of the peer in the proctoring, while the batcher
+            # gathers frames of all rooms of the process with the same profile into one forward pass
+            batcher.submit(frame.bgr(imgsz), timestamp, self.tracker, gaze).result()
+
+        if self.client.headless:
+            return None
+        return frame.bgr()
+
+    def __on_suspicion(self, event: dict):
+        print(f"[{self.client.interview_room}] Прокторинг {self.peer_id}: {event['previous_level'].name} -> "
+              f"{event['level'].name} ({'; '.join(event['reasons']) or 'Всё в порядке'})")
+
+    async def close(self):
+        """Closes the connection and releases proctoring models of the peer."""
+
+        self.closed = True
+        await self.connection.close()
+        await frame_pipeline().release(self.source)  # estimator is closed after the last frame of the peer
+        if self.gaze_estimator is not None:
+            self.gaze_estimator.close()
+            self.gaze_estimator = None
+
+    def __show_frame(self, img):
+        """Opens video stream window (is never called in headless mode)."""
 
-            while True:
-                frame = await track.recv()
-                # current_time = time.time()
+        if img is None or self.client.headless:
+            return
+        cv2.imshow(f"Video stream {self.peer_id}", img)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            self.client.headless = True
+            cv2.destroyAllWindows()
 
-                # if current_time - last_sent_time >= send_interval:
-                #     img = frame.to_ndarray()
-                #     img = cv2.cvtColor(img, cv2.COLOR_YUV2RGB_I420)
-                #     proctor.analyze(Image.fromarray(img), 1)
-                #     last_sent_time = current_time
+    def forward(self, peer_id: str, track) -> None:
+        """
+        Starts sending track of another peer to this one (SFU mode, peer receives it after `negotiate`).
 
-                # Open video stream window
-                img = frame.to_ndarray()
-                img = cv2.cvtColor(img, cv2.COLOR_YUV2BGR_I420)
-                cv2.imshow(f"Video stream", img)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
+        Every forwarded track gets its own transceiver: sender stops for good when its track ends,
+        so transceivers of the peers that have left are never reused.
+        """
 
+        transceiver = self.connection.addTransceiver(self.client.relay.subscribe(track, buffered=False), "sendonly")
+        self.forwarded[transceiver.sender] = peer_id
+
+    def unforward(self, peer_id: str) -> None:
+        """Stops sending tracks of another peer (its video element is removed by `peer_disconnect` anyway)."""
+
+        for sender, source_id in list(self.forwarded.items()):
+            if source_id == peer_id:
+                if sender.track is not None:  # sender drops the track when it ends
+                    sender.track.stop()
+                self.forwarded.pop(sender)
+
+    async def negotiate(self):
+        """Sends offer to the peer (or postpones it until the answer to the current offer is received)."""
+
+        if self.__negotiating:
+            self.__renegotiate = True
+            return
+        self.__negotiating = True
+        await self.offer()
+
+    async def accept(self, answer):
+        """Accepts answer to the offer of the agent and sends the postponed offer if needed."""
+
+        await self.send_remote_description(answer)
+        self.__negotiating = False
+        if self.__renegotiate:
+            self.__renegotiate = False
+            await self.negotiate()
 
     async def send_remote_description(self, message):
         await self.connection.setRemoteDescription(
@@ -65,7 +231,7 @@ class P2PConnection:
 
     async def offer(self):
         offer = await self.connection.createOffer()
-        await self.connection.setLocalDescription(offer)
+        await self.connection.setLocalDescription(offer)  # transceivers get their `mid` here
         await self.client.send("data", {
             "sender_id": self.client.id,
             "target_id": self.peer_id,
@@ -73,6 +239,11 @@ class P2PConnection:
             "sdp": {
                 "type": offer.type,
                 "sdp": offer.sdp
+            },
+            "tracks": {
+                transceiver.mid: self.forwarded[transceiver.sender]
+                for transceiver in self.connection.getTransceivers()
+                if transceiver.sender in self.forwarded
             }
         })
 
@@ -110,37 +281,139 @@ class P2PConnection:
 class WebRTCClient:
     """
     AI agent that is based on WebRTC client bot.
+
+    Agent authenticates with a pre-signed token (see `agent/auth.py`) right in the socket handshake,
+    and all agents of the event loop share one pool of HTTP connections.
+    Lost connection is restored by socket.io client with exponential backoff (with jitter),
+    and agent rejoins its room on every reconnection.
+
+    In `mesh` mode peers connect to each other, and agent only receives their video.
+    In `sfu` mode agent connects to every peer and forwards tracks of each peer to the others,
+    so every peer uploads its stream once.
     """
 
-    def __init__(self, name: str, interview_room: int):
+    http_sessions: dict = dict()  # event loop -> HTTP session that is shared by agents of the loop
+
+    def __init__(self, name: str, interview_room: str, headless: bool = HEADLESS, on_ready=None,
+                 mode: str = CALL_MODE, proctoring_profile: str = None):
+        """
+        :param name: Display name of the agent
+        :param interview_room: Name of the interview room
+        :param headless: Whether agent never opens video windows (e.g. on servers)
+        :param on_ready: Function that receives `id` of the agent every time it (re)joins the room
+        :param mode: Topology of the call (`mesh` or `sfu`)
+        :param proctoring_profile: Proctoring profile of the room like `small:480` (profile of the deployment by default)
+        """
+
+        if mode not in ("mesh", "sfu"):
+            raise ValueError(f"Unknown call mode `{mode}`")
+
         self.id = None  # TODO: initialization of `id` is deferred until `peer_list` is called which seems stupid
-        self.client = AsyncClient()
+        self.client = AsyncClient(
+            reconnection=True,
+            reconnection_attempts=0,  # agent lives as long as its room
+            reconnection_delay=0.5,
+            reconnection_delay_max=30,
+            randomization_factor=0.5,
+            http_session=WebRTCClient.http_session()
+        )
         self.client.on("connect", self.__on_connect)
+        self.client.on("disconnect", self.__on_disconnect)
         self.client.on("peer_list", self.__on_peer_list)
+        self.client.on("peer_connect", self.__on_peer_connect)
+        self.client.on("peer_disconnect", self.__on_peer_disconnect)
         self.client.on("data", self.__on_data)
 
         self.name = name
         self.interview_room = interview_room
+        self.on_ready = on_ready
+
+        self.mode = mode
+        self.peers: dict[str, P2PConnection] = dict()
+        self.relay = MediaRelay()
+        self.tracks: dict[str, list] = dict()  # peer id -> tracks received from the peer (SFU mode)
+
+        self.headless = headless  # headless agent never opens video windows (e.g. on servers)
+        self.proctoring_profile = proctoring_profile
+
+        self.ready = asyncio.Event()  # is set when agent has joined the room (and its `id` is known)
+
+    @staticmethod
+    def http_session() -> aiohttp.ClientSession:
+        """HTTP session with keep-alive connections that is shared by all agents of the running event loop."""
 
-        self.peers: dict[int, P2PConnection] = dict()
+        loop = asyncio.get_running_loop()
+        session = WebRTCClient.http_sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0, keepalive_timeout=60))
+            WebRTCClient.http_sessions[loop] = session
+        return session
+
+    @staticmethod
+    async def close_http_session() -> None:
+        """Closes HTTP session of the running event loop (agents of the loop should be closed first)."""
+
+        session = WebRTCClient.http_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def __auth(self) -> dict:
+        return {"token": sign_agent_token(self.interview_room, self.name)}  # every connection gets a fresh token
 
     async def __on_connect(self):
         await self.send("join_room", {"interview_room": self.interview_room})
 
+    async def __on_disconnect(self, reason=None):
+        print(f"Agent of room {self.interview_room} is disconnected ({reason}), peers are closed")
+        self.ready.clear()
+        await self.__close_peers()
+
     async def __on_peer_list(self, data):
         print(f"Received peer list: {data}")
         self.id = data["target_id"]
-        if "peers" not in data.keys():
-            raise NotImplementedError # Room is empty
-        for peer_id in data["peers"].keys():
-            self.peers[peer_id] = P2PConnection(self, peer_id)
-            await self.peers[peer_id].offer()
+        self.ready.set()
+        if self.on_ready is not None:
+            self.on_ready(self.id)
+        for peer_id in data.get("peers", dict()).keys():  # in mesh mode peers that join later send offers themselves
+            await self.__connect_peer(peer_id)
+
+    async def __on_peer_connect(self, data):
+        if self.mode == "sfu":
+            await self.__connect_peer(data["sid"])
+
+    async def __connect_peer(self, peer_id: str):
+        peer = self.peers.get(peer_id)
+        if peer is None:
+            peer = self.peers[peer_id] = P2PConnection(self, peer_id)
+            for source_id, tracks in self.tracks.items():
+                for track in tracks:
+                    peer.forward(source_id, track)
+        await peer.negotiate()
+
+    async def __on_peer_disconnect(self, data):
+        self.tracks.pop(data["sid"], None)
+        peer = self.peers.pop(data["sid"], None)
+        if peer is not None:
+            await peer.close()
+        for other in self.peers.values():
+            other.unforward(data["sid"])
+
+    async def forward(self, peer_id: str, track):
+        """Forwards track received from the peer to all other peers (SFU mode)."""
+
+        self.tracks.setdefault(peer_id, []).append(track)
+        for other_id, other in list(self.peers.items()):
+            if other_id != peer_id:
+                other.forward(peer_id, track)
+                await other.negotiate()
 
     async def __on_data(self, data):
+        if data["sender_id"] not in self.peers:
+            self.peers[data["sender_id"]] = P2PConnection(self, data["sender_id"])
         peer = self.peers[data["sender_id"]]
         handlers = {
             "offer": peer.answer,
-            "answer": peer.send_remote_description,
+            "answer": peer.accept,
             "new-ice-candidate": peer.candidate
         }
         await handlers[data["type"]](data)
@@ -148,17 +421,40 @@ class WebRTCClient:
     @classmethod
     async def connect_to_socket(cls, name: str, interview_room: str) -> 'WebRTCClient':
         client = cls(name, interview_room)
-        async with aiohttp.ClientSession() as session:
-            uri = f"http://{HOST}:{PORT}/interview/{client.interview_room}/checkpoint/"
-            async with session.post(
-                    uri,
-                    data={"display_name": client.name, "mute_audio": 1, "mute_video": 1},
-                    allow_redirects=False
-            ) as r:
-                headers = {"Cookie": f"session={r.cookies['session'].value}"}
-                socket_uri = f"http://{HOST}:{PORT}"
-                await client.client.connect(socket_uri, headers=headers)
+        await client.connect()
         return client
 
+    async def connect(self, max_attempts: int = 6) -> None:
+        """
+        Connects to the backend socket (agent joins its room as soon as it is connected).
+
+        Failed attempts are retried with exponential backoff (with jitter).
+
+        :param max_attempts: Maximum number of attempts
+        """
+
+        for attempt in range(max_attempts):
+            try:
+                await self.client.connect(f"http://{HOST}:{PORT}", auth=self.__auth, transports=["websocket"])
+                return
+            except socketio.exceptions.ConnectionError as e:
+                if attempt == max_attempts - 1:
+                    raise
+                delay = min(0.5 * 2 ** attempt, 30) * (1 + random.random() / 2)
+                print(f"Agent of room {self.interview_room} could not connect ({e}), retrying in {delay:.1f} s")
+                await asyncio.sleep(delay)
+
     async def send(self, event_name: str, message):
         await self.client.emit(event_name, message)
+
+    async def __close_peers(self):
+        for peer in self.peers.values():
+            await peer.close()
+        self.peers.clear()
+        self.tracks.clear()
+
+    async def close(self):
+        """Closes all peer connections and disconnects from the socket."""
+
+        await self.__close_peers()
+        await self.client.disconnect()
@@ -0,0 +1,77 @@
+from globals import *
+
+import asyncio
+import multiprocessing
+import traceback
+
+from agent.web_rtc import WebRTCClient, close_frame_pipeline
+
+
+class AgentWorker:
+    """
+    Process of the agent pool that runs agents of many interview rooms on one event loop.
+
+    Worker receives commands from the manager (`("start", room, proctoring_profile)`, `("stop", room)` and `("exit",)`)
+    and reports events back (`("ready", worker, room, sid)`, `("stopped", worker, room)`
+    and `("error", worker, room, message)`).
+    """
+
+    def __init__(self, index: int, commands: multiprocessing.Queue, events: multiprocessing.Queue,
+                 name: str = AGENT_NAME, ready_timeout: float = 30):
+        self.index = index
+        self.commands = commands
+        self.events = events
+        self.name = name
+        self.ready_timeout = ready_timeout
+
+        self.clients: dict[str, WebRTCClient] = dict()
+        self.tasks: dict[str, asyncio.Task] = dict()
+
+    async def __start_agent(self, room: str, proctoring_profile: str = None) -> None:
+        # agent reports its new sid every time it rejoins the room after reconnection
+        client = WebRTCClient(self.name, room, on_ready=lambda sid: self.events.put(("ready", self.index, room, sid)),
+                              proctoring_profile=proctoring_profile)
+        self.clients[room] = client
+        try:
+            await client.connect()
+            await asyncio.wait_for(client.ready.wait(), self.ready_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Агент комнаты {room} не запустился: {e}\n{traceback.format_exc()}")
+            self.events.put(("error", self.index, room, str(e)))
+            await self.__stop_agent(room, report=False)
+
+    async def __stop_agent(self, room: str, report: bool = True) -> None:
+        task = self.tasks.pop(room, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        client = self.clients.pop(room, None)
+        if client is not None:
+            try:
+                await client.close()
+            except Exception as e:
+                print(f"Агент комнаты {room} закрыт с ошибкой: {e}")
+        if report:
+            self.events.put(("stopped", self.index, room))
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            command, *args = await loop.run_in_executor(None, self.commands.get)
+            if command == "start" and args[0] not in self.clients:
+                self.tasks[args[0]] = asyncio.create_task(self.__start_agent(*args))
+            elif command == "stop":
+                await self.__stop_agent(args[0])
+            elif command == "exit":
+                for room in list(self.clients):
+                    await self.__stop_agent(room)
+                await WebRTCClient.close_http_session()
+                close_frame_pipeline()
+                return
+
+
+def run_worker(index: int, commands: multiprocessing.Queue, events: multiprocessing.Queue) -> None:
+    """Entry point of the process of the agent pool."""
+
+    asyncio.run(AgentWorker(index, commands, events).run())
@@ -0,0 +1,98 @@
+import contextlib
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+
+class RequirementsCache:
+    """
+    Persistent cache of job requirements that were extracted from vacancies.
+
+    Cache is content-addressed: key is a hash of the normalized text of the vacancy,
+    extraction schema (aspects and concepts) and name of the model,
+    so the same vacancy is never sent to LLM twice, no matter how its file is named.
+    Cache is bounded by `max_entries` and evicts least recently used entries.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1000):
+        self.path = path
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+
+        with self.__connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS requirements_cache ("
+                "key TEXT PRIMARY KEY, "
+                "job_requirements TEXT NOT NULL, "
+                "last_used REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def key(text: str, schema, model: str) -> str:
+        """
+        Computes key of the cache entry.
+
+        :param text: Text of the vacancy (whitespace is normalized)
+        :param schema: JSON-serializable description of the extraction schema
+        :param model: Name of the model
+
+        :returns: Hash of the entry.
+        """
+
+        normalized_text = re.sub(r"\s+", " ", text).strip()
+        content = json.dumps([normalized_text, schema, model], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> list[str] | None:
+        """Returns cached job requirements or `None` on miss."""
+
+        with self.__lock, self.__connect() as connection:
+            row = connection.execute(
+                "SELECT job_requirements FROM requirements_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            connection.execute("UPDATE requirements_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, job_requirements: list[str]) -> None:
+        """Stores job requirements, evicting least recently used entries if cache is full."""
+
+        with self.__lock, self.__connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO requirements_cache (key, job_requirements, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(job_requirements, ensure_ascii=False), time.time())
+            )
+            connection.execute(
+                "DELETE FROM requirements_cache WHERE key NOT IN "
+                "(SELECT key FROM requirements_cache ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+
+    def metrics(self) -> dict[str, float]:
+        with self.__connect() as connection:
+            entries = connection.execute("SELECT COUNT(*) FROM requirements_cache").fetchone()[0]
+        requests = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
+
+    @contextlib.contextmanager
+    def __connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:  # commits on success
+                yield connection
+        finally:
+            connection.close()
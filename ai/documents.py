@@ -0,0 +1,169 @@
+from globals import *
+
+from collections import OrderedDict
+import hashlib
+import os
+import re
+import threading
+
+import contextgem
+import pymupdf
+
+
+def stems(text: str) -> list[str]:
+    """
+    Crude stems of the meaningful words of the text (first 5 letters of words longer than 3 letters).
+
+    :param text: Text
+
+    :return: Stems in order of the words (with repetitions)
+    """
+
+    return [word[:5] for word in re.findall(r"\w+", text.lower()) if len(word) > 3]
+
+
+def iter_pdf_pages(pdf_file: str):
+    """
+    Extracts text from PDF file page by page.
+
+    :param pdf_file: Name of PDF file
+
+    :return: Generator of page texts
+    """
+
+    with pymupdf.open(pdf_file) as f:
+        for page in f.pages():
+            yield page.get_text()
+
+
+def iter_document_parts(filename: str):
+    """
+    Extracts text from file part by part (pages of PDF, lines of TXT, whole text of DOCX).
+
+    :param filename: Name of the file (only PDF, DOCX and TXT are supported)
+
+    :return: Generator of text parts
+    """
+
+    extension = filename.split(".")[-1].lower()
+    if extension == "pdf":
+        yield from iter_pdf_pages(filename)
+    elif extension == "docx":
+        yield contextgem.DocxConverter().convert(filename).raw_text
+    elif extension == "txt":
+        with open(filename) as f:
+            for line in f:
+                yield line.rstrip("\n")
+    else:
+        raise Exception("Only PDF, DOCX and TXT files are allowed")
+
+
+class DocumentLoader:
+    """
+    Ingestion layer for CVs and vacancies.
+
+    Text is extracted part by part and extraction stops as soon as `max_pages` or `max_characters`
+    is reached, so huge uploads can not take over the worker.
+    Extracted text is cached by the hash of the file (files are rehashed only if their mtime changes),
+    so grading the same CV against several vacancies parses it only once.
+    """
+
+    def __init__(self, max_pages: int = MAX_DOCUMENT_PAGES, max_characters: int = MAX_DOCUMENT_CHARACTERS,
+                 max_entries: int = 256):
+        self.max_pages = max_pages
+        self.max_characters = max_characters
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self.__hashes = dict()  # (path, mtime, size) -> hash of the file
+        self.__texts = OrderedDict()  # hash of the file -> text (in LRU order)
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def file_hash(filename: str) -> str:
+        digest = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def extract(self, filename: str) -> str:
+        """
+        Extracts text from the file without using cache.
+
+        :param filename: Name of the file (only PDF, DOCX and TXT are supported)
+
+        :return: Extracted text (truncated to the limits)
+        """
+
+        is_pdf = filename.lower().endswith(".pdf")
+        text = []
+        characters = 0
+        for num, part in enumerate(iter_document_parts(filename)):
+            if is_pdf and num >= self.max_pages:
+                text.append(f"--- Документ обрезан до {self.max_pages} страниц ---")
+                break
+            if is_pdf:
+                text.append(f"--- Страница №{num + 1} ---")
+
+            if characters + len(part) > self.max_characters:
+                text.append(part[:self.max_characters - characters])
+                text.append(f"--- Документ обрезан до {self.max_characters} символов ---")
+                break
+            text.append(part)
+            characters += len(part)
+        return "\n".join(text)
+
+    def text(self, filename: str) -> str:
+        """
+        Returns text of the file, extracting it only if file was not parsed before.
+
+        :param filename: Name of the file (only PDF, DOCX and TXT are supported)
+
+        :return: Extracted text (truncated to the limits)
+        """
+
+        if filename.lower().endswith(".pdf"):  # files with the same contents share cached text, but not the name
+            return f"--- Название файла: {os.path.splitext(os.path.basename(filename))[0]} ---\n" + self.__text(filename)
+        return self.__text(filename)
+
+    def __text(self, filename: str) -> str:
+        stat = os.stat(filename)
+        stat_key = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+
+        with self.__lock:
+            file_hash = self.__hashes.get(stat_key)
+        if file_hash is None:
+            file_hash = self.file_hash(filename)
+
+        with self.__lock:
+            self.__hashes[stat_key] = file_hash
+            if file_hash in self.__texts:
+                self.__texts.move_to_end(file_hash)
+                self.hits += 1
+                return self.__texts[file_hash]
+            self.misses += 1
+
+        text = self.extract(filename)
+        with self.__lock:
+            self.__texts[file_hash] = text
+            while len(self.__texts) > self.max_entries:
+                self.__texts.popitem(last=False)
+            if len(self.__hashes) > 4 * self.max_entries:  # forget outdated versions of files
+                self.__hashes = {k: v for k, v in self.__hashes.items() if v in self.__texts}
+        return text
+
+    def document(self, filename: str) -> contextgem.Document:
+        """
+        Converts file into structured document.
+
+        :param filename: Name of the file (only PDF, DOCX and TXT are supported)
+        :return: Structured document with contents of given file
+        """
+
+        return contextgem.Document(raw_text=self.text(filename))
+
+
+documents = DocumentLoader()
@@ -1,8 +1,20 @@
 from globals import *
 
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import logging
+import threading
+
 import contextgem
+import tiktoken
+
+from ai.cache import RequirementsCache
+from ai.documents import documents, stems
+from ai.llm import clients
+
+logger = logging.getLogger(__name__)
 
-import pymupdf
+TOKENIZER = tiktoken.get_encoding("cl100k_base")  # approximation of the tokenizer of the model
 
 
 class Evaluator:
@@ -12,71 +24,32 @@ class Evaluator:
     Evaluator processes document/conversation and gathers context information that is relevant
     for requirements that are imposed for the vacancy.
     It then grades person based on their compliance with the requirements.
-    """
-
-    def __init__(self, job_requirements: list[str]):
-        self.job_requirements = job_requirements
-
-        self.extractor_model = contextgem.DocumentLLM(
-            model="mistral/codestral-2508",
-            api_key=SECRETS["EVALUATOR_MODEL_API_KEY"],
-            output_language="adapt",
-        )
-
-    @staticmethod
-    def __pdf_to_text(pdf_file: str) -> str:
-        """
-        Extracts all text from PDF file.
-
-        :param pdf_file: Name of PDF file
 
-        :return: Extracted text
-        """
+    All requests to LLM are made through the process-wide pool of clients (see `ClientPool`),
+    so evaluators are cheap to create and safe to use from many threads and event loops.
+    Async API (`afrom_vacancy_file`, `agrade`) does not block the event loop of the caller.
+    """
 
-        text = []
-        with pymupdf.open(pdf_file) as f:
-            text.append(f"--- Название файла: {pdf_file[:-4]} ---")
-            for num, page in enumerate(f.pages()):
-                text.append(f"--- Страница №{num + 1} ---")
-                text.append(page.getText())
-        return "\n".join(text)
+    requirements_cache = RequirementsCache(EVALUATION_CACHE_PATH)
 
-    @staticmethod
-    def __file_to_document(filename: str) -> contextgem.Document:
+    def __init__(self, job_requirements: list[str], llm=None):
         """
-        Converts file into structured document.
-
-        :param filename: Name of the file (only PDF, DOCX and TXT are supported)
-        :return: Structured document with contents of given file
+        :param job_requirements: Requirements that are imposed for the vacancy
+        :param llm: LLM with `contextgem.DocumentLLM` interface (shared `clients.llm()` by default)
         """
 
-        extension = filename.split(".")[-1]
-        if extension == "pdf":
-            document = contextgem.Document(raw_text=Evaluator.__pdf_to_text(filename))
-        elif extension == "docx":
-            document = contextgem.DocxConverter().convert(filename)
-        elif extension == "txt":
-            with open(filename) as f:
-                document = contextgem.Document(raw_text=f.read())
-        else:
-            raise Exception("Only PDF, DOCX and TXT files are allowed")
-
-        return document
-
-    @classmethod
-    def from_vacancy_file(cls, filename: str) -> 'Evaluator':
-        """
-        Extracts job requirements from file.
+        self.job_requirements = job_requirements
 
-        :param filename: Name of file (PDF, DOCX and TXT are supported)
+        self.metrics = {"grades": 0, "calls": 0, "tokens_sent": 0}
+        self.__metrics_lock = threading.Lock()
 
-        :return: Evaluator with loaded `job_requirements`
-        """
+        self.extractor_model = llm if llm is not None else clients.llm()
 
-        evaluator = cls([])
+    @staticmethod
+    def __vacancy_aspects() -> list[contextgem.Aspect]:
+        """Aspects that are extracted from the vacancy."""
 
-        document = Evaluator.__file_to_document(filename)
-        document.add_aspects([
+        return [
             contextgem.Aspect(
                 name="Название вакансии",
                 description=("Извлеките ТОЛЬКО название должности/позиции. Ищите: "
@@ -115,9 +88,55 @@ class Evaluator:
                     )
                 ]
             )
-        ])
+        ]
+
+    @staticmethod
+    def __schema(aspects: list[contextgem.Aspect]) -> list:
+        """Description of the extraction schema that is a part of the cache key."""
+
+        return [
+            [aspect.name, aspect.description, aspect.add_justifications,
+             [[concept.name, concept.description] for concept in aspect.concepts]]
+            for aspect in aspects
+        ]
+
+    @classmethod
+    def from_vacancy_file(cls, filename: str, use_cache: bool = True, llm=None) -> 'Evaluator':
+        """
+        Extracts job requirements from file.
+
+        Requirements are cached by the contents of the vacancy (see `RequirementsCache`),
+        so processing of the same vacancy again does not require LLM.
+
+        :param filename: Name of file (PDF, DOCX and TXT are supported)
+        :param use_cache: Whether cached requirements could be used
+        :param llm: LLM with `contextgem.DocumentLLM` interface (shared `clients.llm()` by default)
+
+        :return: Evaluator with loaded `job_requirements`
+        """
+
+        return clients.call(cls.afrom_vacancy_file(filename, use_cache, llm))
+
+    @classmethod
+    async def afrom_vacancy_file(cls, filename: str, use_cache: bool = True, llm=None) -> 'Evaluator':
+        """Async version of `from_vacancy_file`."""
+
+        evaluator = cls([], llm)
+
+        document = await asyncio.to_thread(documents.document, filename)
+        aspects = Evaluator.__vacancy_aspects()
 
-        processed_document = evaluator.extractor_model.extract_all(document, max_items_per_call=1)
+        key = RequirementsCache.key(document.raw_text, Evaluator.__schema(aspects), evaluator.extractor_model.model)
+        if use_cache:
+            job_requirements = await asyncio.to_thread(Evaluator.requirements_cache.get, key)
+            if job_requirements is not None:
+                evaluator.job_requirements = job_requirements
+                return evaluator
+
+        document.add_aspects(aspects)
+        processed_document = await clients.request(
+            lambda: evaluator.extractor_model.extract_all_async(document, max_items_per_call=1)
+        )
         evaluator.job_requirements.append(str(processed_document.aspects[0].extracted_items[0].value))
         for job_requirement in processed_document.aspects[1].extracted_items:
             job_requirement_text = [
@@ -128,9 +147,104 @@ class Evaluator:
             for sentence in job_requirement.reference_sentences:
                 job_requirement_text.append(f"* {sentence.raw_text} \n")
             evaluator.job_requirements.append("\n".join(job_requirement_text))
+
+        await asyncio.to_thread(Evaluator.requirements_cache.put, key, evaluator.job_requirements)
         return evaluator
 
-    def grade(self, cv_file: str = None, conversation: str = None) -> dict[str, (int, str)]:
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        """Approximate number of tokens in the text."""
+
+        return len(TOKENIZER.encode(text, disallowed_special=()))
+
+    @staticmethod
+    def __grading_prompt(job_requirements: list[str]) -> str:
+        """Description of the rating concept that grades given requirements."""
+
+        job_requirements_text = []
+        for i, job_requirement in enumerate(job_requirements):
+            job_requirements_text.append(f"Requirement №{i + 1}:" + job_requirement)
+        job_requirements_text = "\n".join(job_requirements_text)
+
+        return (
+            "Оцените кандидата по каждому критерию отдельно по шкале 1-100.\n"
+            "ВАЖНО: Дайте отдельную оценку для КАЖДОГО из перечисленных критериев.\n\n"
+            "КРИТЕРИИ ДЛЯ ОЦЕНКИ:\n"
+            f"{job_requirements_text}\n"
+            "ПРАВИЛА ОЦЕНКИ:\n"
+            "• 90-100: Полностью соответствует или превышает требования\n"
+            "• 70-89: Хорошо соответствует большинству требований\n"
+            "• 50-69: Частично соответствует, есть потенциал\n"
+            "• 30-49: Слабое соответствие\n"
+            "• 1-29: Не соответствует требованиям\n\n"
+            "Для КАЖДОГО критерия укажите конкретные факты из резюме/интервью и\n"
+            "ВАЖНО: указать в обосновании почему оценка не выше и не ниже установленной"
+        )
+
+    def plan_grading(self, document_text: str, token_budget: int = EVALUATION_TOKEN_BUDGET,
+                     indices: list[int] = None) -> (list[list[int]], str):
+        """
+        Splits requirements into groups, so that prompt of every group fits into the token budget.
+
+        Every group contains at least one requirement.
+        If document alone does not leave room for the largest requirement, the document is truncated.
+
+        :param document_text: Text of the graded document (CV and/or conversation)
+        :param token_budget: Maximum number of tokens of one prompt
+        :param indices: Indices of the requirements that are graded (all requirements by default)
+
+        :return: Groups of indices of requirements (in order) and text of the document
+        """
+
+        indices = list(range(len(self.job_requirements))) if indices is None else list(indices)
+        base_tokens = Evaluator.count_tokens(Evaluator.__grading_prompt([]))
+        requirement_tokens = [
+            Evaluator.count_tokens(f"Requirement №{i + 1}:" + self.job_requirements[i]) + 1
+            for i in indices
+        ]
+
+        document_tokens = TOKENIZER.encode(document_text, disallowed_special=())
+        document_budget = token_budget - base_tokens - max(requirement_tokens, default=0)
+        if len(document_tokens) > document_budget:
+            document_tokens = document_tokens[:max(document_budget, 0)]
+            document_text = TOKENIZER.decode(document_tokens)
+
+        requirements_budget = token_budget - base_tokens - len(document_tokens)
+        groups = []
+        group_tokens = 0
+        for i, tokens in zip(indices, requirement_tokens):
+            if not groups or group_tokens + tokens > requirements_budget:
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(i)
+            group_tokens += tokens
+        return groups, document_text
+
+    async def __agrade_group(self, document_text: str, job_requirements: list[str]) -> list[(int, str)]:
+        """Grades person on the group of requirements with a single request to LLM."""
+
+        prompt = Evaluator.__grading_prompt(job_requirements)
+        with self.__metrics_lock:
+            self.metrics["calls"] += 1
+            self.metrics["tokens_sent"] += Evaluator.count_tokens(prompt) + Evaluator.count_tokens(document_text)
+
+        document = contextgem.Document(raw_text=document_text)
+        document.add_concepts([
+            contextgem.RatingConcept(
+                name="Overall Vacancy Fit Assessment",
+                description=prompt,
+                rating_scale=(1, 100),
+                add_justifications=True,
+                justification_depth="balanced",
+                justification_max_sents=3,
+            )
+        ])
+
+        grades = (await clients.request(lambda: self.extractor_model.extract_concepts_from_document_async(document)))[0]
+        return [(grade.value, grade.justification) for grade in grades.extracted_items]
+
+    def grade(self, cv_file: str = None, conversation: str = None,
+              token_budget: int = EVALUATION_TOKEN_BUDGET, indices: list[int] = None) -> dict[str, (int, str)]:
         """
         Grades person based on job requirements.
 
@@ -139,50 +253,173 @@ class Evaluator:
         Because of that, this function could grade only the conversation or only the CV of a person,
         or both simultaneously.
 
+        Requirements are split into groups that fit into `token_budget` (see `plan_grading`),
+        and groups are graded concurrently.
+
         :param cv_file: Filename of the CV file (only PDF and DOCX are supported)
         :param conversation: Conversation between interviewer/interviewee
+        :param token_budget: Maximum number of tokens of one request to LLM
+        :param indices: Indices of the requirements that are graded (all requirements by default)
 
         :return: Dictionary with grades and justifications for compliance with each requirement
         """
 
+        return clients.call(self.agrade(cv_file, conversation, token_budget, indices))
+
+    async def agrade(self, cv_file: str = None, conversation: str = None,
+                     token_budget: int = EVALUATION_TOKEN_BUDGET, indices: list[int] = None) -> dict[str, (int, str)]:
+        """Async version of `grade`."""
+
         full_document = ["", ""]
         if cv_file is not None:
-            full_document[0] = "Резюме:\n" + Evaluator.__file_to_document(cv_file).raw_text
+            full_document[0] = "Резюме:\n" + await asyncio.to_thread(documents.text, cv_file)
         if conversation is not None:
             full_document[1] = "Записанное интервью\n" + conversation
-        full_document = contextgem.Document(raw_text="\n\n".join(full_document))
-
-        job_requirements_text = []
-        for i, job_requirement in enumerate(self.job_requirements):
-            job_requirements_text.append(f"Requirement №{i + 1}:" + job_requirement)
-        job_requirements_text = "\n".join(job_requirements_text)
-
-        full_document.add_concepts([
-            contextgem.RatingConcept(
-                name="Overall Vacancy Fit Assessment",
-                description=(
-                    "Оцените кандидата по каждому критерию отдельно по шкале 1-100.\n"
-                    "ВАЖНО: Дайте отдельную оценку для КАЖДОГО из перечисленных критериев.\n\n"
-                    "КРИТЕРИИ ДЛЯ ОЦЕНКИ:\n"
-                    f"{job_requirements_text}\n"
-                    "ПРАВИЛА ОЦЕНКИ:\n"
-                    "• 90-100: Полностью соответствует или превышает требования\n"
-                    "• 70-89: Хорошо соответствует большинству требований\n"
-                    "• 50-69: Частично соответствует, есть потенциал\n"
-                    "• 30-49: Слабое соответствие\n"
-                    "• 1-29: Не соответствует требованиям\n\n"
-                    "Для КАЖДОГО критерия укажите конкретные факты из резюме/интервью и\n"
-                    "ВАЖНО: указать в обосновании почему оценка не выше и не ниже установленной"
-                ),
-                rating_scale=(1, 100),
-                add_justifications=True,
-                justification_depth="balanced",
-                justification_max_sents=3,
-            )
-        ])
+        groups, document_text = await asyncio.to_thread(
+            self.plan_grading, "\n\n".join(full_document), token_budget, indices
+        )
 
+        grades = await asyncio.gather(*(
+            self.__agrade_group(document_text, [self.job_requirements[i] for i in group]) for group in groups
+        ))
         evaluation = {}
-        grades = self.extractor_model.extract_concepts_from_document(full_document)[0]
-        for job_requirement, grade in zip(self.job_requirements, grades.extracted_items):
-            evaluation[job_requirement] = (grade.value, grade.justification)
+        for group, group_grades in zip(groups, grades):
+            for i, grade in zip(group, group_grades):
+                evaluation[self.job_requirements[i]] = grade
+
+        with self.__metrics_lock:
+            self.metrics["grades"] += 1
         return evaluation
+
+    def grade_many(self, cv_files: list[str], max_in_flight: int = None):
+        """
+        Grades many CVs against job requirements concurrently.
+
+        Requests to LLM share the limiter of the pool (see `ClientPool.request`),
+        so at most `clients.max_in_flight` of them are made at the same time in the whole process,
+        and only requests that hit rate limits are retried.
+
+        :param cv_files: Filenames of the CV files
+        :param max_in_flight: Maximum number of CVs that are graded at the same time (`clients.max_in_flight` by default)
+
+        :return: Generator of `(cv_file, evaluation, error)` in order of completion
+                 (`evaluation` is the result of `grade`, `error` is `None` on success)
+        """
+
+        max_in_flight = clients.max_in_flight if max_in_flight is None else max_in_flight
+        executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="evaluator")
+        try:
+            futures = {executor.submit(self.grade, cv_file=cv_file): cv_file for cv_file in cv_files}
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    yield futures[future], None, future.exception()
+                else:
+                    yield futures[future], future.result(), None
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class IncrementalEvaluator:
+    """
+    Evaluator of the conversation that grades the interview while it is going on.
+
+    Every new segment of the transcript is graded only against the requirements it is likely relevant to
+    (requirements that share the most word stems with the segment),
+    and running per-requirement scores are updated,
+    so the final report is ready right after the call ends without re-sending the whole transcript to LLM.
+
+    Segments are graded one by one in the background thread, in order of their arrival.
+    Segments that could not be graded are logged and kept in `failures`.
+    """
+
+    def __init__(self, evaluator: Evaluator, max_requirements: int = 3, min_overlap: int = 2):
+        """
+        :param evaluator: Evaluator with job requirements
+        :param max_requirements: Maximum number of requirements that one segment is graded against
+        :param min_overlap: Minimum number of shared word stems for segment to be relevant to requirement
+        """
+
+        self.evaluator = evaluator
+        self.max_requirements = max_requirements
+        self.min_overlap = min_overlap
+
+        self.segments_count = 0
+        self.scores: dict[str, (float, str, int)] = dict()  # requirement -> (score, justification, number of grades)
+        self.failures: list[(str, str)] = []  # (segment, error) of segments that were not graded
+
+        self.__requirement_stems = [set(stems(r)) for r in evaluator.job_requirements]
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="incremental-evaluator")
+        self.__lock = threading.Lock()
+
+    def relevant_requirements(self, segment: str) -> list[int]:
+        """
+        Picks requirements that segment is likely relevant to.
+
+        :param segment: Segment of the transcript
+
+        :return: Indices of the relevant requirements
+        """
+
+        segment_stems = set(stems(segment))
+        overlaps = [len(segment_stems & requirement_stems) for requirement_stems in self.__requirement_stems]
+        ranked = sorted(range(len(overlaps)), key=lambda i: -overlaps[i])
+        return sorted(i for i in ranked[:self.max_requirements] if overlaps[i] >= self.min_overlap)
+
+    def add_segment(self, segment: str) -> dict[str, (int, str)]:
+        """
+        Grades segment of the transcript and updates running scores.
+
+        Requests that hit rate limits are retried by the pool of clients (see `ClientPool.request`),
+        and if grading still fails, the error is logged and the segment is added to `failures`
+        without delaying grading of the next segments.
+
+        :param segment: Segment of the transcript
+
+        :return: Grades of the segment for each relevant requirement
+        """
+
+        indices = self.relevant_requirements(segment)
+        try:
+            grades = self.evaluator.grade(conversation=segment, indices=indices) if indices else {}
+        except Exception as e:
+            logger.error(f"Segment of the interview was not graded: {e!r}")
+            with self.__lock:
+                self.failures.append((segment, repr(e)))
+            raise
+
+        with self.__lock:
+            self.segments_count += 1
+            for requirement, (score, justification) in grades.items():
+                old_score, _, count = self.scores.get(requirement, (0, "", 0))
+                self.scores[requirement] = ((old_score * count + score) / (count + 1), justification, count + 1)
+        return grades
+
+    def submit_segment(self, segment: str) -> Future:
+        """
+        Grades segment in the background (see `add_segment`).
+
+        Failures are logged and kept in `failures`, so the returned future could be discarded.
+        """
+
+        return self.__executor.submit(self.add_segment, segment)
+
+    def report(self, wait: bool = True) -> dict[str, (int, str)]:
+        """
+        Returns grades of the conversation in the same format as `Evaluator.grade`.
+
+        Requirements that were never discussed are not present in the report,
+        and segments that could not be graded are listed in `failures`.
+
+        :param wait: Whether to wait for grading of all submitted segments
+        """
+
+        if wait:
+            self.__executor.submit(lambda: None).result()
+        with self.__lock:
+            return {
+                requirement: (round(self.scores[requirement][0]), self.scores[requirement][1])
+                for requirement in self.evaluator.job_requirements if requirement in self.scores
+            }
+
+    def close(self):
+        self.__executor.shutdown(wait=False, cancel_futures=True)
@@ -17,8 +17,9 @@ class Interviewer:
     and on-the-fly inference + Text-to-Speech conversion.
     """
 
-    def __init__(self, pretrained: bool = True):
+    def __init__(self, pretrained: bool = True, evaluator: 'IncrementalEvaluator' = None):
         self.full_conversation: str = ""
+        self.evaluator = evaluator  # grades the conversation while the interview is going on
 
         self.speech_to_text = None  # https://github.com/KoljaB/RealtimeSTT
         self.model = None  # https://huggingface.co/cointegrated/rubert-tiny
@@ -39,6 +40,14 @@ class Interviewer:
         while pygame.mixer.music.get_busy():
             pygame.time.Clock().tick(10)
 
+    def add_to_conversation(self, speaker: str, text: str) -> None:
+        """Appends replica to the conversation and sends it to the incremental evaluator."""
+
+        segment = f"{speaker}: {text}"
+        self.full_conversation += segment + "\n"
+        if self.evaluator is not None:
+            self.evaluator.submit_segment(segment)
+
     # Still need to think about the API, but it seems that realtimedness complicates things a LOT.
     def process_text(text):
         print(text)
@@ -0,0 +1,333 @@
+from globals import *
+
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import contextgem
+import httpx
+import litellm
+
+
+class FakeRateLimitError(Exception):
+    """Error that imitates rate limits of LLM provider."""
+
+    status_code = 429
+
+
+class FakeDocumentLLM:
+    """
+    Deterministic local stand-in for `contextgem.DocumentLLM`.
+
+    It implements the part of the `DocumentLLM` interface that is used by `Evaluator`
+    (`model`, `extract_all` and `extract_concepts_from_document` with their async versions)
+    and returns plausible results that depend only on the text of the document.
+    Latency of the calls and failures (rate limits) could be configured,
+    so evaluation pipeline could be load-tested without live paid API.
+    Time that was spent "in the model" is tracked to separate it from the overhead of the pipeline
+    (see `model_time_between`, concurrent calls are counted once).
+    """
+
+    model = "fake/document-llm"
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.1, failure_rate: float = 0.0, seed: int = 0):
+        """
+        :param latency: Mean latency of the call in seconds
+        :param jitter: Maximum deviation of the latency in seconds
+        :param failure_rate: Probability of the call to fail with `FakeRateLimitError`
+        :param seed: Seed of the random generator (latencies and failures)
+        """
+
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+        self.calls = 0
+        self.failures = 0
+        self.model_time = 0.0  # summed latency of all calls
+        self.intervals: list[(float, float)] = []  # (start, end) of every call by `time.perf_counter`
+
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def __seed(text: str) -> int:
+        return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+
+    def __request(self) -> (float, bool):
+        """Draws latency of the request and whether it fails."""
+
+        with self.__lock:
+            self.calls += 1
+            latency = max(self.latency + self.__random.uniform(-self.jitter, self.jitter), 0)
+            failed = self.__random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+            self.model_time += latency
+        return latency, failed
+
+    def __record(self, start: float) -> None:
+        with self.__lock:
+            self.intervals.append((start, time.perf_counter()))
+
+    def model_time_between(self, start: float, end: float) -> float:
+        """
+        Wall time between `start` and `end` (by `time.perf_counter`) when at least one call was in progress.
+
+        Intervals of concurrent calls are merged, so the result never exceeds `end - start`.
+        """
+
+        with self.__lock:
+            intervals = sorted((max(s, start), min(e, end)) for s, e in self.intervals if s < end and e > start)
+        total = 0.0
+        current_start, current_end = None, None
+        for s, e in intervals:
+            if current_end is None or s > current_end:
+                if current_end is not None:
+                    total += current_end - current_start
+                current_start, current_end = s, e
+            else:
+                current_end = max(current_end, e)
+        if current_end is not None:
+            total += current_end - current_start
+        return total
+
+    def __call(self) -> None:
+        """Imitates latency and failures of the request."""
+
+        latency, failed = self.__request()
+        start = time.perf_counter()
+        time.sleep(latency)
+        self.__record(start)
+        if failed:
+            raise FakeRateLimitError("Rate limit exceeded (fake)")
+
+    async def __acall(self) -> None:
+        """Imitates latency and failures of the request without blocking the event loop."""
+
+        latency, failed = self.__request()
+        start = time.perf_counter()
+        await asyncio.sleep(latency)
+        self.__record(start)
+        if failed:
+            raise FakeRateLimitError("Rate limit exceeded (fake)")
+
+    def extract_all(self, document: contextgem.Document, max_items_per_call: int = 0):
+        """
+        Extracts title of the vacancy and requirements (lines of the document).
+
+        :returns: Object with `aspects[i].extracted_items`, which are shaped like items of `contextgem`.
+        """
+
+        self.__call()
+        return FakeDocumentLLM.__extract_all(document)
+
+    async def extract_all_async(self, document: contextgem.Document, max_items_per_call: int = 0):
+        await self.__acall()
+        return FakeDocumentLLM.__extract_all(document)
+
+    @staticmethod
+    def __extract_all(document: contextgem.Document):
+        lines = [line.strip() for line in document.raw_text.splitlines() if len(line.strip()) > 20]
+        title = lines[0] if lines else "Вакансия"
+        requirements = [
+            SimpleNamespace(
+                value=line,
+                justification="Требование явно указано в тексте вакансии.",
+                reference_sentences=[SimpleNamespace(raw_text=line)]
+            )
+            for line in lines[1:11]
+        ]
+        return SimpleNamespace(aspects=[
+            SimpleNamespace(extracted_items=[SimpleNamespace(value=title)]),
+            SimpleNamespace(extracted_items=requirements),
+        ])
+
+    def extract_concepts_from_document(self, document: contextgem.Document) -> list:
+        """
+        Grades every requirement that is listed in the description of the rating concept.
+
+        :returns: List with a single concept, which `extracted_items` contain grades and justifications.
+        """
+
+        self.__call()
+        return FakeDocumentLLM.__extract_concepts(document)
+
+    async def extract_concepts_from_document_async(self, document: contextgem.Document) -> list:
+        await self.__acall()
+        return FakeDocumentLLM.__extract_concepts(document)
+
+    @staticmethod
+    def __extract_concepts(document: contextgem.Document) -> list:
+        description = document.concepts[0].description
+        requirements_count = len(re.findall(r"Requirement №\d+:", description))
+        generator = random.Random(FakeDocumentLLM.__seed(document.raw_text + description))
+        grades = [
+            SimpleNamespace(value=generator.randint(1, 100), justification="Оценка получена локальной заглушкой.")
+            for _ in range(requirements_count)
+        ]
+        return [SimpleNamespace(extracted_items=grades)]
+
+
+def is_rate_limit(error: Exception) -> bool:
+    """Checks whether error was caused by rate limits of LLM provider."""
+
+    return "RateLimit" in type(error).__name__ or getattr(error, "status_code", None) == 429
+
+
+def create_llm(backend: str = EVALUATOR_BACKEND):
+    """
+    Creates LLM that is used by `Evaluator`.
+
+    Any object that provides `model`, `extract_all_async` and `extract_concepts_from_document_async`
+    with semantics of `contextgem.DocumentLLM` could be used as LLM of `Evaluator`.
+
+    :param backend: Name of the backend (`mistral` or `fake`)
+
+    :return: LLM
+    """
+
+    if backend == "mistral":
+        return contextgem.DocumentLLM(
+            model="mistral/codestral-2508",
+            api_key=SECRETS["EVALUATOR_MODEL_API_KEY"],
+            output_language="adapt",
+        )
+    if backend == "fake":
+        return FakeDocumentLLM()
+    raise ValueError(f"Unknown LLM backend `{backend}`")
+
+
+class ClientPool:
+    """
+    Process-wide pool of LLM clients.
+
+    All requests to LLM are made from one background event loop,
+    and `litellm` uses long-lived HTTP clients with keep-alive connections,
+    so concurrent evaluations reuse connections instead of paying a TLS handshake for each request.
+    Callers from any thread (or any other event loop) submit coroutines to the loop of the pool,
+    so shared LLMs are never used from two threads at once.
+    Requests made through `request` share one limiter, so at most `max_in_flight` of them
+    are in flight in the whole process, however many evaluators and threads make them.
+    """
+
+    def __init__(self, max_connections: int = 32, keepalive_expiry: float = 60, timeout: float = 600,
+                 max_in_flight: int = EVALUATION_MAX_IN_FLIGHT):
+        """
+        :param max_connections: Maximum number of open connections
+        :param keepalive_expiry: Time in seconds after which idle connection is closed
+        :param timeout: Timeout of the request in seconds
+        :param max_in_flight: Maximum number of concurrent requests to LLM made through `request`
+        """
+
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.__in_flight = asyncio.Semaphore(max_in_flight)  # used only from the loop of the pool
+
+        self.__llms = dict()
+        self.__loop: asyncio.AbstractEventLoop | None = None
+        self.__thread: threading.Thread | None = None
+        self.__lock = threading.Lock()
+
+    def llm(self, backend: str = EVALUATOR_BACKEND):
+        """Returns shared LLM of given backend (see `create_llm`), creating it on first use."""
+
+        with self.__lock:
+            if backend not in self.__llms:
+                self.__llms[backend] = create_llm(backend)
+            return self.__llms[backend]
+
+    def __start(self) -> asyncio.AbstractEventLoop:
+        """Starts the loop of the pool and installs shared HTTP clients (does nothing if they are already started)."""
+
+        with self.__lock:
+            if self.__loop is None:
+                limits = httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=self.keepalive_expiry
+                )
+                litellm.client_session = httpx.Client(limits=limits, timeout=self.timeout)
+                litellm.aclient_session = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+
+                self.__loop = asyncio.new_event_loop()
+                self.__thread = threading.Thread(target=self.__loop.run_forever, name="llm-clients", daemon=True)
+                self.__thread.start()
+            return self.__loop
+
+    def call(self, coroutine):
+        """
+        Runs coroutine on the loop of the pool and waits for its result (blocks the calling thread).
+
+        :param coroutine: Coroutine that makes requests to LLM
+
+        :return: Result of the coroutine
+        """
+
+        loop = self.__start()
+        if threading.current_thread() is self.__thread:
+            coroutine.close()
+            raise RuntimeError("Blocking call from the loop of the pool (use `await clients.run(...)`)")
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    async def run(self, coroutine):
+        """
+        Runs coroutine on the loop of the pool and awaits its result from any event loop.
+
+        :param coroutine: Coroutine that makes requests to LLM
+
+        :return: Result of the coroutine
+        """
+
+        loop = self.__start()
+        if asyncio.get_running_loop() is loop:
+            return await coroutine
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+    async def request(self, make_request, max_retries: int = 5):
+        """
+        Makes request to LLM on the loop of the pool, holding one of `max_in_flight` slots.
+
+        Requests that hit rate limits are retried with exponential backoff (and jitter),
+        and the slot is released while waiting.
+
+        :param make_request: Function without arguments that returns coroutine of the request
+        :param max_retries: Maximum number of retries
+
+        :return: Result of the request
+        """
+
+        return await self.run(self.__request(make_request, max_retries))
+
+    async def __request(self, make_request, max_retries: int):
+        for attempt in range(max_retries + 1):
+            try:
+                async with self.__in_flight:
+                    return await make_request()
+            except Exception as e:
+                if attempt == max_retries or not is_rate_limit(e):
+                    raise
+            await asyncio.sleep(min(2 ** attempt, 30) * (1 + random.random()))
+
+    def close(self) -> None:
+        """Stops the loop of the pool and closes HTTP clients."""
+
+        with self.__lock:
+            if self.__loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(litellm.aclient_session.aclose(), self.__loop).result()
+            litellm.client_session.close()
+            litellm.client_session = litellm.aclient_session = None
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            self.__thread.join()
+            self.__loop.close()
+            self.__loop = self.__thread = None
+
+
+clients = ClientPool()
@@ -0,0 +1,195 @@
+from enum import Enum
+import logging
+import os
+import threading
+import time
+
+import mediapipe as mp
+import psutil
+from ultralytics import YOLO
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceBackend(Enum):
+    """Runtime that executes YOLO models."""
+
+    PYTORCH = "pytorch"
+    ONNX = "onnx"  # ONNX Runtime, CPU provider
+    ONNX_INT8 = "onnx-int8"  # ONNX Runtime with dynamically quantized weights
+    OPENVINO = "openvino"
+
+
+def export_yolo(weights: str, backend: InferenceBackend) -> str:
+    """
+    Exports YOLO weights for the given backend.
+
+    Exported model is stored next to the weights and is reused if it already exists.
+
+    :param weights: Path to the PyTorch weights
+    :param backend: Backend that should run the model
+
+    :returns: Path to the exported model.
+    """
+
+    stem = os.path.splitext(weights)[0]
+    if backend == InferenceBackend.PYTORCH:
+        return weights
+    elif backend == InferenceBackend.OPENVINO:
+        path = f"{stem}_openvino_model"
+        if not os.path.exists(path):
+            path = YOLO(weights).export(format="openvino", dynamic=True)
+        return path
+
+    path = f"{stem}.onnx"
+    if not os.path.exists(path):
+        path = YOLO(weights).export(format="onnx", dynamic=True)
+    if backend == InferenceBackend.ONNX_INT8:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        quantized_path = f"{stem}.int8.onnx"
+        if not os.path.exists(quantized_path):
+            quantize_dynamic(path, quantized_path, weight_type=QuantType.QUInt8)
+        path = quantized_path
+    return path
+
+
+def load_yolo(weights: str, backend: InferenceBackend, metrics: dict = None) -> YOLO:
+    """
+    Loads YOLO model that is run by the given backend.
+
+    If model could not be exported or loaded, PyTorch model is used instead.
+
+    :param weights: Path to the PyTorch weights
+    :param backend: Backend that should run the model
+    :param metrics: Dictionary that receives backend that actually runs the model
+                    (and the reason of the fallback to PyTorch, if any)
+
+    :returns: Loaded model.
+    """
+
+    metrics = metrics if metrics is not None else dict()
+    metrics["backend"] = backend.value
+    if backend == InferenceBackend.PYTORCH:
+        return YOLO(weights)
+    try:
+        return YOLO(export_yolo(weights, backend), task="detect")
+    except Exception as e:
+        logger.warning(f"Не удалось загрузить {weights} через {backend.value}, используется PyTorch: {e!r}")
+        metrics["backend"] = InferenceBackend.PYTORCH.value
+        metrics["fallback"] = repr(e)
+        return YOLO(weights)
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of models that are used by the proctoring.
+
+    Every model is loaded lazily on the first request and then shared
+    by every `Proctor`/`GetPersonsGaze` in the process,
+    so the number of concurrent interviews does not affect startup time and memory usage.
+
+    Registry also tracks how long each model was loading and how much resident memory it took
+    (and, for YOLO models, which backend actually runs the model).
+    """
+
+    def __init__(self):
+        self.__models = dict()
+        self.__loaders = dict()
+        self.__locks = dict()
+        self.__lock = threading.Lock()
+
+        self.metrics: dict[str, dict] = dict()
+
+    def register(self, name: str, loader) -> None:
+        """
+        Registers model loader.
+
+        :param name: Name of the model
+        :param loader: Function without arguments that loads the model
+        """
+
+        with self.__lock:
+            self.__loaders[name] = loader
+            self.__locks.setdefault(name, threading.Lock())
+
+    def get(self, name: str):
+        """
+        Returns shared instance of the model, loading it if needed.
+
+        :param name: Name of the model
+
+        :returns: Loaded model.
+        """
+
+        if name in self.__models:
+            return self.__models[name]
+
+        with self.__lock:
+            if name not in self.__loaders:
+                raise KeyError(f"Model `{name}` is not registered")
+            lock = self.__locks[name]
+
+        with lock:  # other models can be loaded at the same time
+            if name not in self.__models:
+                process = psutil.Process()
+                rss_before = process.memory_info().rss
+                start = time.perf_counter()
+
+                model = self.__loaders[name]()
+
+                self.metrics.setdefault(name, dict()).update({
+                    "load_time": time.perf_counter() - start,
+                    "memory": process.memory_info().rss - rss_before,
+                })
+                self.__models[name] = model
+        return self.__models[name]
+
+    def lock(self, name: str) -> threading.Lock:
+        """
+        Returns lock of the model.
+
+        Should be held by models that are not safe to be called from several threads (e.g. `FaceMesh`).
+
+        :param name: Name of the model
+        """
+
+        self.get(name)
+        return self.__locks[name]
+
+    def register_yolo(self, weights: str, backend: InferenceBackend = InferenceBackend.PYTORCH) -> str:
+        """
+        Registers YOLO model with given weights and backend if it is not registered yet.
+
+        :param weights: Path to the PyTorch weights
+        :param backend: Backend that should run the model
+
+        :returns: Name of the model in the registry.
+        """
+
+        name = weights if backend == InferenceBackend.PYTORCH else f"{weights}@{backend.value}"
+        if name not in self.__loaders:
+            self.register(name, lambda: load_yolo(weights, backend, self.metrics.setdefault(name, dict())))
+        return name
+
+    def warm_up(self, names: list[str] = None) -> None:
+        """
+        Loads models in advance (e.g. at process start),
+        so the first frame of an interview does not pay for the model loading.
+
+        :param names: Names of the models to load (all registered models by default),
+                      YOLO models should be registered first (see `register_yolo`)
+        """
+
+        for name in names if names is not None else list(self.__loaders.keys()):
+            self.get(name)
+
+
+MASKS_WEIGHTS: str = "models/masks_model.pt"
+FACE_MESH: str = "face_mesh"
+
+models = ModelRegistry()
+models.register_yolo(MASKS_WEIGHTS)
+models.register(FACE_MESH, lambda: mp.solutions.face_mesh.FaceMesh(
+    static_image_mode=True,
+    refine_landmarks=True))
@@ -1,10 +1,18 @@
+from globals import *
+
+import asyncio
+from concurrent.futures import Future
 from enum import Enum
+import queue
+import threading
+import time
 
 import cv2
 import mediapipe as mp
 import numpy as np
 from PIL import Image
-from ultralytics import YOLO
+
+from ai.models import models, InferenceBackend, MASKS_WEIGHTS, FACE_MESH
 
 
 class SuspicionLevel(Enum):
@@ -16,6 +24,183 @@ class SuspicionLevel(Enum):
     ALERT = 3
 
 
+class ModelTier(Enum):
+    """Size of the YOLO model that detects persons and phones (bigger is more accurate, but slower)."""
+
+    NANO = "yolo11n.pt"
+    SMALL = "yolo11s.pt"
+    MEDIUM = "yolo11m.pt"
+    X = "yolo11x.pt"
+
+
+class ProctoringProfile:
+    """
+    Speed/accuracy tradeoff of the proctoring.
+
+    Default profile is configured per deployment (see `PROCTORING_TIER` and `PROCTORING_IMGSZ`),
+    but every interview room could use its own profile.
+    """
+
+    def __init__(self, tier: ModelTier = None, imgsz: int = None, backend: InferenceBackend = None):
+        self.tier = tier or ModelTier[PROCTORING_TIER.upper()]
+        self.imgsz = imgsz or PROCTORING_IMGSZ
+        self.backend = backend or InferenceBackend(PROCTORING_BACKEND)
+
+    @classmethod
+    def from_string(cls, profile: str) -> 'ProctoringProfile':
+        """
+        Parses profile from string like `small`, `small:480` or `small:480:onnx`.
+
+        :param profile: Name of the tier with optional input resolution and backend
+
+        :returns: Parsed profile
+        """
+
+        tier, imgsz, backend = (profile.split(":") + ["", ""])[:3]
+        return cls(
+            ModelTier[tier.upper()],
+            int(imgsz) if imgsz else None,
+            InferenceBackend(backend) if backend else None
+        )
+
+    def register_models(self) -> (str, str):
+        """
+        Registers YOLO models of the profile in the model registry.
+
+        :returns: Registry names of the person/phone model and of the mask model.
+        """
+
+        return models.register_yolo(self.tier.value, self.backend), models.register_yolo(MASKS_WEIGHTS, self.backend)
+
+    def warm_up(self) -> None:
+        """Loads models of the profile in advance, so the first frame does not pay for the model loading."""
+
+        models.warm_up(list(self.register_models()))
+
+    def __repr__(self):
+        return f"{self.tier.name.lower()}:{self.imgsz}:{self.backend.value}"
+
+
+class SuspicionTracker:
+    """
+    State machine of the proctor concerns about one interviewee.
+
+    Every anomaly found on a frame adds its weight to the score of its signal,
+    and all scores decay exponentially with `half_life` seconds.
+    One-off suspicious movement therefore fades away quickly,
+    while consistent anomalies accumulate and raise the suspicion level.
+
+    Tracker emits structured event only when the suspicion level changes,
+    so the volume of the output does not depend on the frame rate.
+    """
+
+    WEIGHTS = {
+        "no_person": 1.0,
+        "many_people": 2.0,
+        "phone": 3.0,
+        "mask": 1.0,
+        "gaze_away": 0.5,
+    }
+    REASONS = {
+        "no_person": "Нет человека на изображении",
+        "many_people": "Много людей в кадре",
+        "phone": "Телефон в руках обнаружен",
+        "mask": "Попросите снять маску",
+        "gaze_away": "Взгляд отведён от экрана",
+    }
+    THRESHOLDS = [
+        (SuspicionLevel.ALERT, 8.0),
+        (SuspicionLevel.SUSPICIOUS, 4.0),
+        (SuspicionLevel.SLIGHTLY_SUSPICIOUS, 1.5),
+    ]
+
+    def __init__(self, half_life: float = 10.0, on_event=None):
+        """
+        :param half_life: Time (in seconds) during which score of the signal halves
+        :param on_event: Function that receives events (events are printed by default)
+        """
+
+        self.half_life = half_life
+        self.on_event = on_event or SuspicionTracker.__print_event
+
+        self.level = SuspicionLevel.NORMAL
+        self.reason = ""
+        self.scores = {signal: 0.0 for signal in SuspicionTracker.WEIGHTS}
+        self.timecode = None
+
+    @staticmethod
+    def signals(detections: dict = None, gaze: str = None) -> list[str]:
+        """
+        Lists anomalies of a single frame.
+
+        :param detections: Detections of the frame (see `Proctor.detect_batch`)
+        :param gaze: Direction of view (see `GazeEstimator.estimate`)
+        """
+
+        signals = []
+        if detections is not None:
+            if detections["people_count"] == 0:
+                signals.append("no_person")
+            if detections["people_count"] > 1:
+                signals.append("many_people")
+            if detections["phone_detected"]:
+                signals.append("phone")
+            if detections["mask_detected"]:
+                signals.append("mask")
+        if gaze in ("left", "right", "up", "down"):
+            signals.append("gaze_away")
+        return signals
+
+    @property
+    def score(self) -> float:
+        return sum(self.scores.values())
+
+    def update(self, timecode: float, detections: dict = None, gaze: str = None) -> dict | None:
+        """
+        Updates state of the tracker with signals of the next frame.
+
+        :param timecode: Time of the frame in seconds
+        :param detections: Detections of the frame (see `Proctor.detect_batch`)
+        :param gaze: Direction of view on the frame
+
+        :returns: Event if suspicion level has changed, `None` otherwise.
+        """
+
+        if self.timecode is not None:
+            decay = 0.5 ** (max(timecode - self.timecode, 0) / self.half_life)
+            for signal in self.scores:
+                self.scores[signal] *= decay
+        self.timecode = timecode
+
+        for signal in SuspicionTracker.signals(detections, gaze):
+            self.scores[signal] += SuspicionTracker.WEIGHTS[signal]
+
+        score = self.score
+        level = next((level for level, threshold in SuspicionTracker.THRESHOLDS if score >= threshold),
+                     SuspicionLevel.NORMAL)
+        if level == self.level:
+            return None
+
+        strongest = sorted((signal for signal in self.scores if self.scores[signal] >= 0.5),
+                           key=lambda signal: -self.scores[signal])
+        event = {
+            "timecode": timecode,
+            "level": level,
+            "previous_level": self.level,
+            "score": score,
+            "reasons": [SuspicionTracker.REASONS[signal] for signal in strongest],
+        }
+        self.level = level
+        self.reason = "; ".join(event["reasons"])
+        self.on_event(event)
+        return event
+
+    @staticmethod
+    def __print_event(event: dict):
+        print(f"[{event['timecode']:.1f}] {event['previous_level'].name} -> {event['level'].name}: "
+              f"{'; '.join(event['reasons']) or 'Всё в порядке'}")
+
+
 class Proctor:
     """
     Proctor for the interview that is trained to detect anomalies of interviewee behaviour and report it.
@@ -26,56 +211,205 @@ class Proctor:
     after than system is not detecting any anomalies for a long time,
     then suspicion level is dropped.
     Something similar also happens if person frequently behaves suspicious.
+    State of the interviewee is kept by `SuspicionTracker`.
     """
 
-    def __init__(self):
-        self.model = YOLO('yolo11x.pt')
-        self.model_masks = YOLO('models/masks_model.pt')
+    def __init__(self, profile: ProctoringProfile = None, tracker: SuspicionTracker = None):
+        self.profile = profile or ProctoringProfile()
+        self.tracker = tracker or SuspicionTracker()
 
-    def analyze(self, image: Image, timecode: int) -> (SuspicionLevel, str):
+        self.model_name, self.model_masks_name = self.profile.register_models()
+
+        self.model = models.get(self.model_name)
+        self.model_masks = models.get(self.model_masks_name)
+
+    def analyze(self, image: Image, timecode: float, gaze: str = None) -> (SuspicionLevel, str):
         """
         Analyzes image of the interviewee and detects anomalies of his behaviour.
 
-        :param image: Image of the interviewee
-        :param timecode: Timecode of the image
+        :param image: Image of the interviewee (PIL image or BGR array)
+        :param timecode: Timecode of the image in seconds
+        :param gaze: Direction of view on the image (see `GazeEstimator.estimate`), if it is known
 
         :returns: Current concerns of the proctor - suspicion level and reasoning for it.
         """
 
-        results = self.model.predict(source=image, conf=0.25, verbose=False)
-        results_mask = self.model_masks(source=image, conf=0.5, verbose=False)
+        return self.analyze_batch([image], [timecode], gazes=[gaze])[0]
+
+    def analyze_batch(self, frames: list[Image], timecodes: list[float],
+                      trackers: list[SuspicionTracker] = None,
+                      gazes: list[str | None] = None) -> list[(SuspicionLevel, str)]:
+        """
+        Analyzes several images at once (possibly from different interviews).
+
+        Every model runs only one batched forward pass for all frames,
+        which is considerably cheaper on CPU than running `analyze` for each frame.
+
+        :param frames: Images of the interviewees (PIL images or BGR arrays)
+        :param timecodes: Timecodes of the images in seconds
+        :param trackers: Trackers of the interviewees on each frame (tracker of the proctor by default)
+        :param gazes: Directions of view on each frame (`None` where it is unknown)
+
+        :returns: Concerns of the proctor for each frame (in the same order as `frames`).
+        """
+
+        trackers = trackers or [self.tracker] * len(frames)
+        gazes = gazes or [None] * len(frames)
+        if not len(frames) == len(timecodes) == len(trackers) == len(gazes):
+            raise ValueError("Each frame should have its own timecode, tracker and gaze")
+
+        concerns = []
+        for detections, timecode, tracker, gaze in zip(self.detect_batch(frames), timecodes, trackers, gazes):
+            tracker.update(timecode, detections, gaze)
+            concerns.append((tracker.level, tracker.reason))
+        return concerns
+
+    def detect_batch(self, frames: list[Image]) -> list[dict]:
+        """
+        Runs detectors on several images at once.
+
+        :param frames: Images of the interviewees
+
+        :returns: Detections for each frame - `people_count`, `phone_detected` and `mask_detected`.
+        """
+
+        if not frames:
+            return []
+
+        with models.lock(self.model_name):
+            results = self.model.predict(source=frames, conf=0.25, imgsz=self.profile.imgsz, verbose=False)
+        with models.lock(self.model_masks_name):
+            results_mask = self.model_masks.predict(source=frames, conf=0.5, imgsz=self.profile.imgsz, verbose=False)
+        return [
+            Proctor.__interpret(result, result_mask)
+            for result, result_mask in zip(results, results_mask)
+        ]
+
+    @staticmethod
+    def __interpret(result, result_mask) -> dict:
+        """
+        Interprets detections of both models on a single frame.
+
+        :param result: Detections of persons and phones
+        :param result_mask: Detections of masks
+
+        :returns: Detections of the frame.
+        """
+
         phone_detected = False
         people_count = 0
-        flag = 0
-
-        for result in results:
-            for box in result.boxes:
-                cls = int(box.cls[0])
-                label = result.names[cls]
-
-                if label == 'person':
-                    people_count += 1
-                if label == 'cell phone':
-                    phone_detected = True
-
-        mask_detected = results_mask[0].names[int(
-            results_mask[0].boxes[0].cls[0])] == "with_mask"
-
-        if people_count == 0:
-            flag = 1
-            print("Нет человека на изображении!")
-        if phone_detected:
-            flag = 1
-            print("Телефон в руках обнаружен!")
-        if people_count > 1:
-            flag = 1
-            print("Много людей в кадре!")
-        if mask_detected:
-            flag = 1
-            print("Попросите снять маску!")
-        if flag == 0:
-            print("Всё в порядке.")
-        return SuspicionLevel.NORMAL, ""
+
+        for box in result.boxes:
+            cls = int(box.cls[0])
+            label = result.names[cls]
+
+            if label == 'person':
+                people_count += 1
+            if label == 'cell phone':
+                phone_detected = True
+
+        mask_detected = len(result_mask.boxes) > 0 and result_mask.names[int(
+            result_mask.boxes[0].cls[0])] == "with_mask"
+
+        return {
+            "people_count": people_count,
+            "phone_detected": phone_detected,
+            "mask_detected": mask_detected,
+        }
+
+
+class ProctorBatcher:
+    """
+    Micro-batching scheduler for `Proctor`.
+
+    Frames that are submitted by different interviews are gathered into batches
+    which are analyzed by one `Proctor.analyze_batch` call.
+    Batch is dispatched either when it reaches `max_batch_size` frames
+    or when its oldest frame has waited for `max_wait` seconds,
+    so latency of every single frame stays bounded.
+    """
+
+    def __init__(self, proctor: Proctor, max_batch_size: int = 8, max_wait: float = 0.05):
+        self.proctor = proctor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.batches_count = 0
+        self.frames_count = 0
+
+        self.__queue = queue.Queue()
+        self.__worker = threading.Thread(target=self.__run, daemon=True)
+        self.__worker.start()
+
+    def submit(self, image: Image, timecode: float, tracker: SuspicionTracker = None, gaze: str = None) -> Future:
+        """
+        Schedules image for the analysis.
+
+        :param image: Image of the interviewee
+        :param timecode: Timecode of the image in seconds
+        :param tracker: Tracker of the interviewee (tracker of the proctor by default)
+        :param gaze: Direction of view on the image, if it is known
+
+        :returns: Future that resolves to concerns of the proctor (see `Proctor.analyze`).
+        """
+
+        future = Future()
+        self.__queue.put((image, timecode, tracker or self.proctor.tracker, gaze, future))
+        return future
+
+    async def analyze(self, image: Image, timecode: float, tracker: SuspicionTracker = None,
+                      gaze: str = None) -> (SuspicionLevel, str):
+        """Asynchronous version of `submit` that could be awaited from the event loop."""
+
+        return await asyncio.wrap_future(self.submit(image, timecode, tracker, gaze))
+
+    def close(self):
+        """Stops scheduler after all already submitted frames are analyzed."""
+
+        self.__queue.put(None)
+        self.__worker.join()
+
+    def __collect(self) -> (list, bool):
+        """Collects next batch, blocking until at least one frame is available."""
+
+        item = self.__queue.get()
+        if item is None:
+            return [], True
+
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.__queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def __run(self):
+        closed = False
+        while not closed:
+            batch, closed = self.__collect()
+            if not batch:
+                continue
+
+            frames, timecodes, trackers, gazes, futures = zip(*batch)
+            try:
+                results = self.proctor.analyze_batch(list(frames), list(timecodes), list(trackers), list(gazes))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            self.batches_count += 1
+            self.frames_count += len(batch)
+            for future, result in zip(futures, results):
+                future.set_result(result)
 
 
 class GetPersonsGaze:
@@ -85,10 +419,8 @@ class GetPersonsGaze:
 
     def __init__(self, path):
         self.path = path
-        # модель для обнаружения ключевых точек
-        self.face_mesh = mp.solutions.face_mesh.FaceMesh(
-            static_image_mode=True,
-            refine_landmarks=True)
+        # модель для обнаружения ключевых точек (общая для всех экземпляров)
+        self.face_mesh = models.get(FACE_MESH)
 
         self.LEFT_IRIS_IDX = [468, 469, 470, 471,
                               472]  # индексы, которые отмечают радужную оболочку левого глаза
@@ -155,7 +487,8 @@ class GetPersonsGaze:
         h, w = img.shape[:2]
         img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
-        results = self.face_mesh.process(img_rgb)
+        with models.lock(FACE_MESH):
+            results = self.face_mesh.process(img_rgb)
         if not results.multi_face_landmarks:
             return {"error": "Лицо не найдено"}
 
@@ -204,46 +537,159 @@ class GetPersonsGaze:
         return final
 
 
+class GazeEstimator:
+    """
+    Streaming estimator of a person's direction of view.
+
+    Unlike `GetPersonsGaze`, estimator works with in-memory frames of one video stream
+    and runs FaceMesh in tracking mode, so landmarks are only tracked between consecutive frames
+    instead of being detected from scratch.
+    Landmarks are converted to one array and both eyes are classified in vectorized form.
+
+    Estimator keeps tracking state, so every video stream should have its own estimator.
+    """
+
+    IRIS_IDX = np.array([[468, 469, 470, 471, 472],  # радужка левого глаза
+                         [473, 474, 475, 476, 477]])  # радужка правого глаза
+    EYE_CORNERS_IDX = np.array([[33, 133],  # углы левого глаза
+                                [362, 263]])  # углы правого глаза
+
+    def __init__(self, x_thresh: float = 0.15, y_thresh: float = 0.12):
+        self.x_thresh = x_thresh
+        self.y_thresh = y_thresh
+
+        self.face_mesh = mp.solutions.face_mesh.FaceMesh(
+            static_image_mode=False,
+            max_num_faces=1,
+            refine_landmarks=True)
+
+    @staticmethod
+    def landmarks_to_array(landmarks, image_w: int, image_h: int) -> np.ndarray:
+        """Переводит все landmarks из нормализованных координат в пиксели одним массивом (N, 2)."""
+
+        xy = np.fromiter((c for landmark in landmarks for c in (landmark.x, landmark.y)),
+                         dtype=np.float32, count=2 * len(landmarks)).reshape(-1, 2)
+        return xy * np.array([image_w, image_h], dtype=np.float32)
+
+    def classify(self, points: np.ndarray) -> str:
+        """
+        Classifies direction of view by landmarks of the face (both eyes at once).
+
+        :param points: Landmarks of the face in pixels (see `landmarks_to_array`)
+
+        :returns: 'left', 'right', 'up', 'down' or 'center'.
+        """
+
+        iris = points[GazeEstimator.IRIS_IDX].mean(axis=1)  # центры радужек (2, 2)
+        corners = points[GazeEstimator.EYE_CORNERS_IDX]  # (2, 2, 2)
+        centers = corners.mean(axis=1)
+        widths = np.linalg.norm(corners[:, 0] - corners[:, 1], axis=1)
+        sizes = np.stack([widths, widths * 0.6], axis=1)  # высота глаза как в `GetPersonsGaze`
+
+        dx, dy = ((iris - centers) / sizes).T
+        ax, ay = np.abs(dx), np.abs(dy)
+        directions = np.where(
+            (ax < self.x_thresh) & (ay < self.y_thresh),
+            "center",
+            np.where(ax >= ay, np.where(dx < 0, "left", "right"), np.where(dy < 0, "up", "down"))
+        )
+
+        # если оба глаза говорят одно и то же -> берем его, иначе берем более выраженное смещение
+        if directions[0] == directions[1]:
+            return str(directions[0])
+        return str(directions[np.argmax(np.maximum(ax, ay))])
+
+    def estimate(self, image_rgb: np.ndarray) -> str | None:
+        """
+        Estimates direction of view on the next frame of the stream.
+
+        :param image_rgb: Frame in RGB
+
+        :returns: Direction of view or `None` if face was not found.
+        """
+
+        h, w = image_rgb.shape[:2]
+        results = self.face_mesh.process(image_rgb)
+        if not results.multi_face_landmarks:
+            return None
+        return self.classify(self.landmarks_to_array(results.multi_face_landmarks[0].landmark, w, h))
+
+    def estimate_batch(self, frames: list[np.ndarray]) -> list[str | None]:
+        """
+        Estimates direction of view on several consecutive frames of the stream.
+
+        :param frames: Frames in RGB (in order of the stream)
+
+        :returns: Direction of view on each frame (see `estimate`).
+        """
+
+        return [self.estimate(frame) for frame in frames]
+
+    def close(self):
+        self.face_mesh.close()
+
+
 class AntiCheat:
     """
     Checks if a person is cheating based on their gaze.
     The sliding window contains last 300 seconds of person's gaze,
     if the last 15 seconds' most common gaze differs from it,
     there is an alarm for an interviewer.
+
+    Gazes are stored in a ring buffer with running counts of every state for both windows,
+    so each step takes constant time regardless of the window sizes.
     """
 
-    def __init__(self):
+    STATES = ["up", "down", "left", "right", "center"]
+
+    def __init__(self, short_window: float = 15, long_window: float = 300, fps: float = 1):
+        """
+        :param short_window: Length of the short window in seconds
+        :param long_window: Length of the long window in seconds
+        :param fps: Number of steps per second
+        """
+
+        self.short_steps = max(1, round(short_window * fps))
+        self.long_steps = max(self.short_steps, round(long_window * fps))
+
         self.long_gaze = ""
-        self.gazes = []
         self.short_gaze = ""
         self.curr_time = 0
 
+        self.gazes = [-1] * self.long_steps  # кольцевой буфер индексов состояний (-1 - неизвестно)
+        self.short_counts = [0] * len(AntiCheat.STATES)
+        self.long_counts = [0] * len(AntiCheat.STATES)
+
     @staticmethod
-    def _get_most_popular_state(array) -> str:
-        states = dict()
-        states["ups"] = array.count("up")
-        states["downs"] = array.count("down")
-        states["lefts"] = array.count("left")
-        states["rights"] = array.count("right")
-        states["centers"] = array.count("center")
-
-        most_popular = max(states.values())
-        # возвращает первый ключ, значение которого равно most_popular
-        return next((k for k, v in states.items() if v == most_popular), None)
+    def _get_most_popular_count(counts: list[int]) -> str:
+        """Most popular state by running counts (e.g. `ups`), the first of the states wins ties."""
 
-    def step(self, status: str) -> None:
-        self.gazes.append(status)
+        # `index` возвращает первое состояние с максимальным количеством
+        return AntiCheat.STATES[counts.index(max(counts))] + "s"
 
-        if 16 <= self.curr_time:
-            short_gazes = self.gazes[-15:]
-            self.short_gaze = self._get_most_popular_state(short_gazes)
+    def step(self, status: str) -> None:
+        state = AntiCheat.STATES.index(status) if status in AntiCheat.STATES else -1
+
+        position = self.curr_time % self.long_steps
+        if self.curr_time >= self.long_steps:
+            expired = self.gazes[position]  # покидает длинное окно
+            if expired >= 0:
+                self.long_counts[expired] -= 1
+        if self.curr_time >= self.short_steps:
+            expired = self.gazes[(self.curr_time - self.short_steps) % self.long_steps]  # покидает короткое окно
+            if expired >= 0:
+                self.short_counts[expired] -= 1
+
+        self.gazes[position] = state
+        if state >= 0:
+            self.long_counts[state] += 1
+            self.short_counts[state] += 1
+        self.curr_time += 1
 
-            if self.curr_time > 300:
-                long_gazes = self.gazes[-300:]
-                self.long_gaze = self._get_most_popular_state(long_gazes)
-                self.gazes.pop(0)
+        if self.curr_time >= self.short_steps:
+            self.short_gaze = self._get_most_popular_count(self.short_counts)
+            if self.curr_time >= self.long_steps:
+                self.long_gaze = self._get_most_popular_count(self.long_counts)
 
         if self.long_gaze != self.short_gaze and self.long_gaze != "":
             print("АЛЯРМА!!!!11!!!1!! ПОДОЗРЕНИЕ НА СПИСЫВАНИЕ!11!!!!111111!!!!!!!адын")
-
-        self.curr_time += 1
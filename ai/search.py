@@ -0,0 +1,179 @@
+from globals import *
+
+import os
+import threading
+
+import numpy as np
+
+from ai.documents import documents, stems
+
+
+class CandidateIndex:
+    """
+    Local TF-IDF index of CVs that shortlists candidates for the vacancy before LLM grading.
+
+    Every document is stored as a sparse vector of term frequencies,
+    and similarity of all documents to the query is computed at once with NumPy
+    (IDF weights depend on the whole corpus, so they are applied at query time).
+    Documents could be added, replaced and removed one by one, so the index is updated incrementally.
+    """
+
+    EXTENSIONS = {"pdf", "docx", "txt"}
+
+    def __init__(self, folder: str = None):
+        """
+        :param folder: Folder with CVs that index is synchronized with (see `sync`)
+        """
+
+        self.folder = folder
+
+        self.vocabulary: dict[str, int] = dict()  # term -> id of the term
+        self.document_frequency = np.zeros(0, dtype=np.int64)
+        self.vectors: dict[str, (np.ndarray, np.ndarray)] = dict()  # key -> (ids of terms, term frequencies)
+
+        self.__versions: dict[str, (int, int)] = dict()  # path -> (mtime, size) of indexed file
+        self.__matrix = None  # concatenated vectors (keys, rows, columns, values), rebuilt after changes
+        self.__lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def __vectorize(self, text: str, grow: bool) -> (np.ndarray, np.ndarray):
+        """Converts text into sparse vector of sublinear term frequencies."""
+
+        counts = dict()
+        for term in stems(text):
+            if term not in self.vocabulary:
+                if not grow:
+                    continue
+                self.vocabulary[term] = len(self.vocabulary)
+            term_id = self.vocabulary[term]
+            counts[term_id] = counts.get(term_id, 0) + 1
+
+        ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        frequencies = 1 + np.log(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))
+        return ids, frequencies
+
+    def add(self, key: str, text: str) -> None:
+        """
+        Adds document to the index (replacing the document with the same key).
+
+        :param key: Key of the document (e.g. path to the file)
+        :param text: Text of the document
+        """
+
+        with self.__lock:
+            self.remove(key)
+            ids, frequencies = self.__vectorize(text, grow=True)
+            if len(self.document_frequency) < len(self.vocabulary):
+                self.document_frequency = np.pad(
+                    self.document_frequency, (0, 2 * len(self.vocabulary) - len(self.document_frequency))
+                )
+            self.document_frequency[ids] += 1
+            self.vectors[key] = (ids, frequencies)
+            self.__matrix = None
+
+    def remove(self, key: str) -> None:
+        """Removes document from the index (does nothing if there is no such document)."""
+
+        with self.__lock:
+            if key not in self.vectors:
+                return
+            ids, _ = self.vectors.pop(key)
+            self.document_frequency[ids] -= 1
+            self.__versions.pop(key, None)
+            self.__matrix = None
+
+    def add_file(self, path: str) -> bool:
+        """
+        Adds file to the index if it was not indexed yet or has changed since.
+
+        :param path: Path to the file (only PDF, DOCX and TXT are supported)
+
+        :return: Whether file was (re)indexed
+        """
+
+        if path.rsplit(".", 1)[-1].lower() not in CandidateIndex.EXTENSIONS:
+            return False
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.__lock:
+            if self.__versions.get(path) == version:
+                return False
+
+        try:
+            text = documents.text(path)
+        except Exception as e:
+            print(f"Не удалось проиндексировать {path}: {e}")
+            return False
+
+        with self.__lock:
+            self.add(path, text)
+            self.__versions[path] = version
+        return True
+
+    def sync(self) -> None:
+        """Indexes new and changed files of the folder and forgets deleted ones."""
+
+        if self.folder is None or not os.path.isdir(self.folder):
+            return
+        paths = {os.path.join(self.folder, filename) for filename in os.listdir(self.folder)}
+        with self.__lock:
+            for path in [key for key in self.__versions if key not in paths]:
+                self.remove(path)
+        for path in sorted(paths):
+            self.add_file(path)
+
+    def __build_matrix(self) -> (list[str], np.ndarray, np.ndarray, np.ndarray):
+        if self.__matrix is None:
+            keys = list(self.vectors)
+            lengths = [len(self.vectors[key][0]) for key in keys]
+            rows = np.repeat(np.arange(len(keys)), lengths)
+            columns = np.concatenate([self.vectors[key][0] for key in keys]) if keys else np.zeros(0, np.int64)
+            values = np.concatenate([self.vectors[key][1] for key in keys]) if keys else np.zeros(0)
+            self.__matrix = (keys, rows, columns, values)
+        return self.__matrix
+
+    def search(self, query: str, k: int = 10) -> list[(str, float)]:
+        """
+        Finds documents that are the most similar to the query (cosine similarity of TF-IDF vectors).
+
+        :param query: Text of the query (e.g. job requirements of the vacancy)
+        :param k: Number of returned documents
+
+        :return: Keys of the documents with their similarities (from the most similar)
+        """
+
+        with self.__lock:
+            keys, rows, columns, values = self.__build_matrix()
+            if not keys:
+                return []
+
+            idf = np.log((1 + len(keys)) / (1 + self.document_frequency[:len(self.vocabulary)])) + 1
+            query_ids, query_frequencies = self.__vectorize(query, grow=False)
+            query_vector = np.zeros(len(self.vocabulary))
+            query_vector[query_ids] = query_frequencies * idf[query_ids]
+            query_norm = np.linalg.norm(query_vector)
+
+            weights = values * idf[columns]
+            norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(keys)))
+            dots = np.bincount(rows, weights=weights * query_vector[columns], minlength=len(keys))
+
+        similarities = dots / np.maximum(norms * query_norm, 1e-12)
+        k = min(k, len(keys))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        return [(keys[i], float(similarities[i])) for i in top]
+
+    def shortlist(self, job_requirements: list[str], k: int = 10) -> list[(str, float)]:
+        """
+        Shortlists candidates for the vacancy (synchronizing the index with the folder first).
+
+        :param job_requirements: Requirements that are imposed for the vacancy
+        :param k: Number of shortlisted candidates
+
+        :return: Paths to the CVs with their similarities to the vacancy (from the most similar)
+        """
+
+        self.sync()
+        return self.search("\n".join(job_requirements), k)
@@ -0,0 +1,229 @@
+from globals import *
+
+from backend.application import application
+from backend.rooms import RoomStore, rooms
+
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from flask import session
+
+logger = logging.getLogger(__name__)
+
+
+class AgentManager:
+    """
+    Supervisor of the fixed pool of agent processes.
+
+    Every process runs agents of many interview rooms on one event loop (see `AgentWorker`).
+    Room is assigned to the least loaded process, and its agent is torn down when the room has no people left.
+    Processes that die are restarted, and agents of their rooms are started again
+    (except agents that were still starting, since they could have killed the process).
+
+    Ownership of agents is kept in the room store, so with several backend processes
+    only the process that has claimed the room runs its agent,
+    and it releases the agent when people of the room (connected to any process) have left.
+    """
+
+    def __init__(self, workers: int = AGENT_WORKERS, check_interval: float = 1.0, store: RoomStore = None):
+        """
+        :param workers: Number of agent processes
+        :param check_interval: Time in seconds between checks of the processes and the rooms
+        :param store: Store of the state of the rooms (shared `rooms` by default)
+        """
+
+        self.workers = workers
+        self.check_interval = check_interval
+        self.store = store if store is not None else rooms
+
+        self.__context = multiprocessing.get_context("spawn")  # agents should not inherit threads of the backend
+        self.__events = self.__context.Queue()
+        self.__processes: list = [None] * workers
+        self.__commands: list = [None] * workers
+
+        self.__room_worker: dict[str, int] = dict()  # room -> index of the worker that runs its agent
+        self.__room_profiles: dict[str, str | None] = dict()  # room -> proctoring profile of its agent
+        self.__agent_sids: dict[str, str] = dict()  # room -> sid of its agent (when agent has joined)
+        self.__restarts = [0] * workers
+
+        self.__supervisor = None
+        self.__closed = False
+        self.__lock = threading.Lock()
+
+    def __spawn(self, index: int) -> None:
+        from agent.worker import run_worker  # backend does not need heavy dependencies of the agent itself
+
+        if self.__commands[index] is not None:
+            self.__commands[index].close()
+        self.__commands[index] = self.__context.Queue()
+        self.__processes[index] = self.__context.Process(
+            target=run_worker,
+            args=(index, self.__commands[index], self.__events),
+            name=f"agent-worker-{index}",
+            daemon=True
+        )
+        self.__processes[index].start()
+        logger.info(f"Agent worker #{index} started (pid {self.__processes[index].pid})")
+
+    def start(self) -> None:
+        """Starts agent processes and their supervisor (does nothing if they are already started)."""
+
+        with self.__lock:
+            if self.__supervisor is not None or self.__closed:
+                return
+            for index in range(self.workers):
+                self.__spawn(index)
+            self.__supervisor = threading.Thread(target=self.__supervise, name="agent-supervisor", daemon=True)
+            self.__supervisor.start()
+
+    def assign(self, room: str, proctoring_profile: str = None) -> int | None:
+        """
+        Starts agent of the room on the least loaded worker (does nothing if the room already has an agent).
+
+        :param room: Name of the interview room
+        :param proctoring_profile: Proctoring profile of the room like `small:480`
+                                   (see `ProctoringProfile.from_string`, profile of the deployment by default)
+
+        :return: Index of the worker that runs agent of the room
+                 or `None` if agent is run by another backend process
+        """
+
+        self.start()
+        with self.__lock:
+            if self.__closed:
+                raise RuntimeError("Agent manager is closed")
+            if room in self.__room_worker:
+                return self.__room_worker[room]
+        if not self.store.claim_agent(room):
+            return None
+        with self.__lock:
+            if self.__closed:
+                self.store.release_agent(room)
+                raise RuntimeError("Agent manager is closed")
+            if room in self.__room_worker:  # assigned by another thread in the meantime
+                return self.__room_worker[room]
+            loads = [0] * self.workers
+            for index in self.__room_worker.values():
+                loads[index] += 1
+            index = min(range(self.workers), key=lambda i: loads[i])
+            self.__room_worker[room] = index
+            self.__room_profiles[room] = proctoring_profile
+            self.__commands[index].put(("start", room, proctoring_profile))
+        logger.info(f"[{room}] Agent is assigned to worker #{index}")
+        return index
+
+    def release(self, room: str) -> None:
+        """Tears down agent of the room (does nothing if the room has no agent in this process)."""
+
+        with self.__lock:
+            index = self.__room_worker.pop(room, None)
+            self.__room_profiles.pop(room, None)
+            self.__agent_sids.pop(room, None)
+            if index is None:
+                return
+            self.__commands[index].put(("stop", room))
+        self.store.release_agent(room)
+        logger.info(f"[{room}] Agent is released by worker #{index}")
+
+    def load(self) -> list[dict]:
+        """Load of every worker: its pid, whether it is alive, number of restarts and rooms it serves."""
+
+        with self.__lock:
+            return [
+                {
+                    "worker": index,
+                    "pid": process.pid if process is not None else None,
+                    "alive": process is not None and process.is_alive(),
+                    "restarts": self.__restarts[index],
+                    "rooms": sorted(room for room, i in self.__room_worker.items() if i == index),
+                }
+                for index, process in enumerate(self.__processes)
+            ]
+
+    def __handle(self, event: tuple) -> None:
+        kind, index, room, *args = event
+        with self.__lock:
+            if self.__room_worker.get(room) != index:  # room was released or reassigned in the meantime
+                return
+            if kind == "ready":
+                self.__agent_sids[room] = args[0]
+                logger.info(f"[{room}] Agent has joined with sid {args[0]}")
+            elif kind == "error":
+                self.__room_worker.pop(room)
+                logger.error(f"[{room}] Agent has failed: {args[0]}")
+        if kind == "error":
+            self.store.release_agent(room)
+
+    def __release_empty_rooms(self) -> None:
+        """Releases agents of the rooms whose people have left through other backend processes."""
+
+        with self.__lock:
+            assigned = list(self.__room_worker)
+        for room in assigned:
+            if self.store.people(room) == 0:
+                self.release(room)
+
+    def __supervise(self) -> None:
+        last_check = time.time()
+        while True:
+            try:
+                self.__handle(self.__events.get(timeout=self.check_interval))
+            except queue.Empty:
+                pass
+
+            if time.time() - last_check < self.check_interval:
+                continue
+            last_check = time.time()
+            dropped = []
+            with self.__lock:
+                if self.__closed:
+                    return
+                for index, process in enumerate(self.__processes):
+                    if process.is_alive():
+                        continue
+                    logger.error(f"Agent worker #{index} died with exit code {process.exitcode}, restarting")
+                    self.__restarts[index] += 1
+                    self.__spawn(index)
+                    for room in [room for room, i in self.__room_worker.items() if i == index]:
+                        if self.__agent_sids.pop(room, None) is None:
+                            self.__room_worker.pop(room)
+                            dropped.append(room)
+                            logger.error(f"[{room}] Agent was starting when worker #{index} died, it is dropped")
+                        else:
+                            self.__commands[index].put(("start", room, self.__room_profiles.get(room)))
+            for room in dropped:
+                self.store.release_agent(room)
+            self.__release_empty_rooms()
+
+    def close(self) -> None:
+        """Stops all agents and their processes."""
+
+        with self.__lock:
+            self.__closed = True
+            for index, commands in enumerate(self.__commands):
+                if commands is not None and self.__processes[index].is_alive():
+                    commands.put(("exit",))
+            released = list(self.__room_worker)
+            self.__room_worker.clear()
+            self.__room_profiles.clear()
+            self.__agent_sids.clear()
+        for room in released:
+            self.store.release_agent(room)
+        for process in self.__processes:
+            if process is not None:
+                process.join(timeout=5)
+
+
+agents = AgentManager()
+
+
+@application.route("/interview/agents", methods=["GET"])
+def agents_route():
+    """Load of the agent workers."""
+
+    if session.get("role_id") != 1:
+        return {"error": "Нагрузку агентов может смотреть только интервьюер"}, 403
+    return {"workers": agents.load()}
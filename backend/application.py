@@ -9,6 +9,8 @@ from sqlalchemy.ext.automap import automap_base
 
 from flask_socketio import SocketIO
 
+from backend.schema import migrate
+
 FLASK_SECRET_KEY: str = SECRETS["FLASK_SECRET_KEY"]
 TEMPLATE_FOLDER: str = "../frontend/templates"
 STATIC_FOLDER: str = "../frontend/static"
@@ -32,6 +34,8 @@ application.config["SQLALCHEMY_DATABASE_URI"] =\
 application.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 db = SQLAlchemy(application)
 with application.app_context():
+    migrate(db.engine)  # tables are created/updated before they are reflected
+
     metadata = sa.MetaData()
     metadata.reflect(db.engine)
 
@@ -42,11 +46,21 @@ with application.app_context():
 
     UserRole = DB.classes.user_role
 
+    Job = DB.classes.job
+
+    Vacancy = DB.classes.vacancy
+    Requirement = DB.classes.requirement
+    Evaluation = DB.classes.evaluation
+    EvaluationGrade = DB.classes.evaluation_grade
+
 # Socket IO
-socketio = SocketIO(application)
+socketio = SocketIO(application, message_queue=SOCKETIO_MESSAGE_QUEUE)
 
 
 def run(host: str = HOST, port: int = PORT):
     """Runs application on `http://{host}:{port}/`"""
 
+    from backend.jobs import jobs  # jobs depend on the models above
+    jobs.start()  # jobs that were left pending or running before restart are picked up without waiting for a new one
+
     socketio.run(app=application, host=host, port=port, debug=DEBUG)
@@ -12,6 +12,8 @@ async def checkpoint_route(interview_room: str):
         mute_audio = request.form["mute_audio"]
         mute_video = request.form["mute_video"]
         session[interview_room] = {"name": display_name, "mute_audio": mute_audio, "mute_video": mute_video}
+        if session.get("role_id") == 1:  # interviewer could choose proctoring profile of the room, e.g. `?proctoring=small:480`
+            session[interview_room]["proctoring"] = request.args.get("proctoring")
         return redirect(url_for("interview_route", interview_room=interview_room))
 
     return render_template("checkpoint.html", interview_room=interview_room)
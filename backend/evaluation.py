@@ -1,6 +1,9 @@
+from globals import *
+
 from backend.application import application
 
-from backend.application import db, User
+from backend.application import db, User, Vacancy, Requirement, Evaluation, EvaluationGrade
+from backend.jobs import jobs
 
 import os
 import time
@@ -13,6 +16,9 @@ from wtforms import SubmitField
 from werkzeug.utils import secure_filename
 
 from ai.evaluation import Evaluator
+from ai.search import CandidateIndex
+
+candidates = CandidateIndex(os.path.join(application.config["UPLOAD_FOLDER"], "cvs"))
 
 
 class VacancyForm(FlaskForm):
@@ -29,6 +35,196 @@ class ResumeForm(FlaskForm):
     submit = SubmitField("Оценить резюме")
 
 
+def summarize(results: dict[str, (int, str)]) -> (float, str):
+    """Computes average score of the evaluation and its text summary."""
+
+    scores = [score for score, _ in results.values()]
+    average_score = sum(scores) / len(scores) if scores else 0
+
+    if average_score >= 90:
+        summary_text = "Отличное соответствие! Кандидат полностью подходит для вакансии."
+    elif average_score >= 70:
+        summary_text = "Хорошее соответствие. Кандидат подходит для большинства требований."
+    elif average_score >= 50:
+        summary_text = "Среднее соответствие. Кандидат требует дополнительного обучения."
+    elif average_score >= 30:
+        summary_text = "Слабое соответствие. Рассмотрите других кандидатов."
+    else:
+        summary_text = "Не соответствует требованиям. Не рекомендуется к найму."
+    return average_score, summary_text
+
+
+def save_vacancy(user_id: int, filepath: str, job_requirements: list[str]) -> int:
+    """Stores processed vacancy with its requirements and returns id of the vacancy."""
+
+    vacancy = Vacancy(user_id=user_id, filepath=filepath, created_at=time.time())
+    db.session.add(vacancy)
+    db.session.flush()
+    db.session.add_all([
+        Requirement(vacancy_id=vacancy.id, position=position, text=text)
+        for position, text in enumerate(job_requirements)
+    ])
+    db.session.commit()
+    return vacancy.id
+
+
+def load_requirements(vacancy_id: int) -> list:
+    """Loads requirements of the vacancy in their original order."""
+
+    return db.session.execute(
+        db.select(Requirement).where(Requirement.vacancy_id == vacancy_id).order_by(Requirement.position)
+    ).scalars().all()
+
+
+def save_evaluation(vacancy_id: int, user_id: int, resume_filepath: str, results: dict[str, (int, str)],
+                    job_id: int = None) -> int:
+    """Stores grades of the CV against the vacancy (made by the batch job, if given) and returns id of the evaluation."""
+
+    average_score, summary_text = summarize(results)
+    evaluation = Evaluation(
+        vacancy_id=vacancy_id,
+        user_id=user_id,
+        resume_filepath=resume_filepath,
+        average_score=average_score,
+        summary_text=summary_text,
+        created_at=time.time(),
+        job_id=job_id
+    )
+    db.session.add(evaluation)
+    db.session.flush()
+
+    requirement_ids = {requirement.text: requirement.id for requirement in load_requirements(vacancy_id)}
+    db.session.add_all([
+        EvaluationGrade(
+            evaluation_id=evaluation.id,
+            requirement_id=requirement_ids[requirement],
+            score=score,
+            justification=justification
+        )
+        for requirement, (score, justification) in results.items()
+    ])
+    db.session.commit()
+    return evaluation.id
+
+
+def load_evaluation(evaluation_id: int) -> (dict[str, (int, str)], float, str):
+    """Loads grades of the evaluation (in order of requirements), its average score and summary."""
+
+    evaluation = db.session.get(Evaluation, evaluation_id)
+    if evaluation is None:
+        return {}, None, ""
+
+    rows = db.session.execute(
+        db.select(Requirement.text, EvaluationGrade.score, EvaluationGrade.justification)
+        .join(Requirement, Requirement.id == EvaluationGrade.requirement_id)
+        .where(EvaluationGrade.evaluation_id == evaluation_id)
+        .order_by(Requirement.position)
+    ).all()
+    results = {text: (score, justification) for text, score, justification in rows}
+    return results, evaluation.average_score, evaluation.summary_text
+
+
+@jobs.handler("process_vacancy")
+def process_vacancy_job(payload: dict) -> dict:
+    evaluator = Evaluator.from_vacancy_file(payload["vacancy_path"])
+    return {"vacancy_id": save_vacancy(payload["user_id"], payload["vacancy_path"], evaluator.job_requirements)}
+
+
+@jobs.handler("grade_resume")
+def grade_resume_job(payload: dict) -> dict:
+    evaluator = Evaluator([requirement.text for requirement in load_requirements(payload["vacancy_id"])])
+    results = evaluator.grade(cv_file=payload["resume_path"])
+    return {"evaluation_id": save_evaluation(payload["vacancy_id"], payload["user_id"], payload["resume_path"], results)}
+
+
+@jobs.handler("index_cv")
+def index_cv_job(payload: dict) -> dict:
+    """Adds uploaded CV to the index of candidates (extraction of the large file does not block the upload)."""
+
+    return {"indexed": candidates.add_file(payload["cv_path"])}
+
+
+def batch_cv_files(job_requirements: list[str], top_k: int = None) -> (list[str], dict[str, float]):
+    """
+    Lists CVs that should be graded against the vacancy.
+
+    :param job_requirements: Requirements of the vacancy
+    :param top_k: Number of CVs that are the most similar to the vacancy (see `CandidateIndex`), all CVs by default
+
+    :return: Paths to the CV files and their similarity to the vacancy (only for shortlisted CVs)
+    """
+
+    if top_k is not None:
+        similarities = dict(candidates.shortlist(job_requirements, top_k))
+        return list(similarities), similarities
+
+    cvs_folder = candidates.folder
+    cv_files = [
+        os.path.join(cvs_folder, filename)
+        for filename in sorted(os.listdir(cvs_folder))
+        if filename.rsplit(".", 1)[-1].lower() in CandidateIndex.EXTENSIONS
+    ] if os.path.isdir(cvs_folder) else []
+    return cv_files, dict()
+
+
+@jobs.handler("grade_batch")
+def grade_batch_job(payload: dict) -> dict:
+    """
+    Grades CVs against the vacancy, saving every evaluation as soon as it is made (see `batch_evaluation_job_route`).
+
+    CVs that already have evaluations of the job are skipped, so a job that is picked up again after restart resumes.
+    """
+
+    evaluator = Evaluator([requirement.text for requirement in load_requirements(payload["vacancy_id"])])
+    cv_files, similarities = batch_cv_files(evaluator.job_requirements, payload.get("top_k"))
+
+    graded = set(db.session.execute(
+        db.select(Evaluation.resume_filepath).where(Evaluation.job_id == payload["job_id"])
+    ).scalars())
+    failed = []
+    for cv_file, results, error in evaluator.grade_many([cv_file for cv_file in cv_files if cv_file not in graded]):
+        if error is not None:
+            failed.append({"cv_file": os.path.basename(cv_file), "error": str(error)})
+        else:
+            save_evaluation(payload["vacancy_id"], payload["user_id"], cv_file, results, job_id=payload["job_id"])
+    return {
+        "total": len(cv_files),
+        "failed": failed,
+        "similarities": {os.path.basename(cv_file): similarity for cv_file, similarity in similarities.items()},
+    }
+
+
+def submit_job(kind: str, payload: dict):
+    """Submits evaluation job and responds with its id without waiting for it."""
+
+    job_id = jobs.submit(kind, payload | {"user_id": session["user_id"]}, session["user_id"])
+    session["job_id"] = job_id
+    if request.accept_mimetypes.best == "application/json":
+        return {"job_id": job_id}, 202
+    flash("Задача поставлена в очередь", "success")
+    return redirect(url_for("evaluation_route"))
+
+
+def apply_finished_job(job: dict) -> None:
+    """Remembers results of the finished evaluation job in the session (only ids are stored)."""
+
+    session.pop("job_id", None)
+    if job["status"] == "failed":
+        if job["kind"] == "process_vacancy":
+            flash(f"Ошибка при обработке вакансии: {job['error']}", "error")
+        else:
+            flash(f"Ошибка при оценке резюме: {job['error']}", "error")
+        return
+
+    if job["kind"] == "process_vacancy":
+        session["vacancy_id"] = job["result"]["vacancy_id"]
+        session.pop("evaluation_id", None)
+        flash("Вакансия успешно обработана!", "success")
+    else:
+        session["evaluation_id"] = job["result"]["evaluation_id"]
+        flash("Резюме успешно оценено!", "success")
+
+
 @application.route("/evaluation", methods=["GET", "POST"])
 async def evaluation_route():
     if "user_id" not in session:
@@ -45,14 +241,28 @@ async def evaluation_route():
     current_user_vacancy = current_user.document_filepath if session.get("role_id") == 1 else None
     current_user_resume = current_user.document_filepath if session.get("role_id") == 2 else None
 
-    vacancy_requirements = session.get("vacancy_requirements", [])
-    evaluation_results = session.get("evaluation_results", {})
-    average_score = session.get("average_score")
-    summary_text = session.get("summary_text", "")
+    pending_job = None
+    if "job_id" in session:
+        job = jobs.status(session["job_id"])
+        if job is None:
+            session.pop("job_id")
+        elif job["status"] in ("done", "failed"):
+            apply_finished_job(job)
+        else:
+            pending_job = job
+
+    vacancy_id = session.get("vacancy_id")
+    vacancy_requirements = [requirement.text for requirement in load_requirements(vacancy_id)] if vacancy_id else []
+    evaluation_results, average_score, summary_text = load_evaluation(session["evaluation_id"]) \
+        if "evaluation_id" in session else ({}, None, "")
 
     if request.method == "POST":
         action = request.form.get("action")
 
+        if pending_job is not None:
+            flash("Дождитесь завершения предыдущей задачи", "error")
+            return redirect(url_for("evaluation_route"))
+
         if action == "process_vacancy":
             vacancy_source = request.form.get("vacancy_source", "new")
 
@@ -74,20 +284,9 @@ async def evaluation_route():
                     flash("Пожалуйста, выберите файл вакансии", "error")
                     return redirect(url_for("evaluation_route"))
 
-            try:
-                evaluator = Evaluator.from_vacancy_file(vacancy_path)
-                vacancy_requirements = evaluator.job_requirements
-
-                session["vacancy_requirements"] = vacancy_requirements
-                session["evaluator"] = evaluator
+            return submit_job("process_vacancy", {"vacancy_path": vacancy_path})
 
-                flash("Вакансия успешно обработана!", "success")
-
-            except Exception as e:
-                flash(f"Ошибка при обработке вакансии: {str(e)}", "error")
-                return redirect(url_for("evaluation_route"))
-
-        elif action == "process_resume" and "evaluator" in session:
+        elif action == "process_resume":
             if not vacancy_requirements:
                 flash("Сначала обработайте вакансию", "error")
                 return redirect(url_for("evaluation_route"))
@@ -112,33 +311,7 @@ async def evaluation_route():
                     flash("Пожалуйста, выберите файл резюме", "error")
                     return redirect(url_for("evaluation_route"))
 
-            try:
-                evaluator = session["evaluator"]
-                results = evaluator.grade(cv_file=resume_path)
-
-                scores = [score for score, _ in results.values()]
-                average_score = sum(scores) / len(scores) if scores else 0
-
-                if average_score >= 90:
-                    summary_text = "Отличное соответствие! Кандидат полностью подходит для вакансии."
-                elif average_score >= 70:
-                    summary_text = "Хорошее соответствие. Кандидат подходит для большинства требований."
-                elif average_score >= 50:
-                    summary_text = "Среднее соответствие. Кандидат требует дополнительного обучения."
-                elif average_score >= 30:
-                    summary_text = "Слабое соответствие. Рассмотрите других кандидатов."
-                else:
-                    summary_text = "Не соответствует требованиям. Не рекомендуется к найму."
-
-                session["evaluation_results"] = results
-                session["average_score"] = average_score
-                session["summary_text"] = summary_text
-
-                flash("Резюме успешно оценено!", "success")
-
-            except Exception as e:
-                flash(f"Ошибка при оценке резюме: {str(e)}", "error")
-                return redirect(url_for("evaluation_route"))
+            return submit_job("grade_resume", {"vacancy_id": vacancy_id, "resume_path": resume_path})
 
     return render_template(
         "evaluation.html",
@@ -149,16 +322,98 @@ async def evaluation_route():
         vacancy_requirements=vacancy_requirements,
         evaluation_results=evaluation_results,
         average_score=average_score,
-        summary_text=summary_text
+        summary_text=summary_text,
+        pending_job=pending_job
     )
 
 
+@application.route("/evaluation/jobs/<int:job_id>", methods=["GET"])
+def evaluation_job_route(job_id: int):
+    """Status of the evaluation job (is polled by the evaluation page)."""
+
+    job = jobs.status(job_id)
+    if job is None or job["user_id"] != session.get("user_id"):
+        return {"error": "Задача не найдена"}, 404
+    return job
+
+
+@application.route("/evaluation/batch", methods=["POST"])
+def batch_evaluation_route():
+    """
+    Submits job that grades every CV in the folder of uploaded CVs against the processed vacancy.
+
+    If `top_k` is passed, only `top_k` CVs that are the most similar to the vacancy
+    (see `CandidateIndex`) are graded.
+    Responds with id of the job at once, results are polled from `/evaluation/batch/<job_id>`.
+    """
+
+    if "user_id" not in session or session.get("role_id") != 1:
+        return {"error": "Оценивать кандидатов может только интервьюер"}, 403
+    if "vacancy_id" not in session:
+        return {"error": "Сначала обработайте вакансию"}, 400
+
+    payload = {
+        "vacancy_id": session["vacancy_id"],
+        "user_id": session["user_id"],
+        "top_k": request.args.get("top_k", type=int),
+    }
+    job_id = jobs.submit("grade_batch", payload, session["user_id"])
+    return {"job_id": job_id, "status_url": url_for("batch_evaluation_job_route", job_id=job_id)}, 202
+
+
+@application.route("/evaluation/batch/<int:job_id>", methods=["GET"])
+def batch_evaluation_job_route(job_id: int):
+    """
+    Status of the batch grading job with CVs that are already graded.
+
+    Evaluations are read from the database, so they are available while the job is still running.
+    `after` (id of the last evaluation that client has) lets client fetch only new evaluations.
+    """
+
+    job = jobs.status(job_id)
+    if job is None or job["kind"] != "grade_batch" or job["user_id"] != session.get("user_id"):
+        return {"error": "Задача не найдена"}, 404
+
+    evaluations = db.session.execute(
+        db.select(Evaluation)
+        .where(Evaluation.job_id == job_id, Evaluation.id > request.args.get("after", 0, type=int))
+        .order_by(Evaluation.id)
+    ).scalars().all()
+    similarities = (job["result"] or dict()).get("similarities", dict())
+
+    lines = []
+    for evaluation in evaluations:
+        results, average_score, summary_text = load_evaluation(evaluation.id)
+        cv_file = os.path.basename(evaluation.resume_filepath)
+        line = {
+            "cv_file": cv_file,
+            "evaluation_id": evaluation.id,
+            "average_score": average_score,
+            "summary_text": summary_text,
+            "results": [
+                {"requirement": requirement.splitlines()[0], "score": score, "justification": justification}
+                for requirement, (score, justification) in results.items()
+            ],
+        }
+        if cv_file in similarities:
+            line["similarity"] = similarities[cv_file]
+        lines.append(line)
+
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "error": job["error"],
+        "total": (job["result"] or dict()).get("total"),
+        "failed": (job["result"] or dict()).get("failed", []),
+        "evaluations": lines,
+    }
+
+
 @application.route("/evaluation/clear")
 def clear_evaluation():
-    session.pop("vacancy_requirements", None)
-    session.pop("evaluation_results", None)
-    session.pop("average_score", None)
-    session.pop("summary_text", None)
-    session.pop("evaluator", None)
+    session.pop("vacancy_id", None)
+    session.pop("evaluation_id", None)
+    session.pop("job_id", None)
     flash("Результаты оценки очищены", "success")
     return redirect(url_for("evaluation_route"))
+
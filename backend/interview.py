@@ -1,17 +1,16 @@
+from globals import *
+
+from agent.auth import load_agent_token
 from backend.application import socketio, application
+from backend.agents import agents
+from backend.rooms import rooms
 from flask import render_template, url_for, redirect, request, session
 from flask_socketio import emit, join_room
 import logging
-import threading
-import asyncio
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-_users_in_room = {} # stores room wise user list
-_room_of_sid = {} # stores room joined by an used
-_name_of_sid = {} # stores display name of users
-
 
 @application.route("/interview/<string:interview_room>/", methods=["GET"])
 async def interview_route(interview_room: str):
@@ -21,40 +20,49 @@ async def interview_route(interview_room: str):
 
 
 @socketio.on("connect")
-def on_connect():
+def on_connect(auth=None):
+    """
+    Agents connect with a signed token instead of passing the checkpoint form,
+    so their socket session gets a member of the room right away.
+    """
+
     sid = request.sid
     logger.info(f"New socket connected with sid: {sid}")
 
+    token = (auth or dict()).get("token")
+    if token is None:
+        return
+    agent = load_agent_token(token)
+    if agent is None:
+        logger.warning(f"Socket {sid} has presented invalid or expired agent token")
+        return False
+    session[agent["interview_room"]] = {"name": agent["name"], "mute_audio": 1, "mute_video": 1, "agent": True}
+
 
 @socketio.on("coding_field_update")
 def coding_field_update(data):
-    """Socket IO handler for live coding session."""
-    
-    logger.critical("Coding field update should be tied to certain room!")
-    emit(
-        "coding_field_update",
-        {"code": data["code"]},
-        broadcast=True,
-        include_self=False
-    )
-    
+    """
+    Socket IO handler for live coding session.
 
-def run_agent_async(interview_room):
-    def agent_thread():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            from agent.application import run
-            logger.info(f"Starting agent in room: {interview_room}")
-            loop.run_until_complete(run())
-        except Exception as e:
-            logger.error(f"Error running agent: {e}")
-        finally:
-            loop.close()
-    
-    thread = threading.Thread(target=agent_thread, daemon=True)
-    thread.start()
-    logger.info(f"Agent thread started for room: {interview_room}")
+    Client sends operation on the editor of its room (`ops`) with the version of the document it was made against.
+    Transformed operation is relayed only to other members of the room, and sender receives acknowledgement
+    (or the snapshot of the document, if its operation could not be applied).
+    """
+
+    interview_room = rooms.room_of(request.sid)
+    if interview_room is None:
+        return
+
+    with rooms.coding_document(interview_room) as document:
+        result = document.submit(data.get("ops"), data.get("version"))
+        if result is None:
+            emit("coding_field_snapshot", document.snapshot())
+            return
+
+        operation, version = result
+        emit("coding_field_ack", {"version": version})
+        emit("coding_field_update", {"ops": operation, "version": version},
+             room=interview_room, include_self=False)
 
 
 @socketio.on("join_room")
@@ -64,47 +72,43 @@ def on_join_room(data):
     display_name = session[interview_room]["name"]
     
     # register sid to the room
-    join_room(interview_room)
-    _room_of_sid[sid] = interview_room
-    _name_of_sid[sid] = display_name
+    with rooms.coding_document(interview_room) as document:  # updates that are relayed before the snapshot are older
+        join_room(interview_room)
+        emit("coding_field_snapshot", document.snapshot())
+    members = rooms.add_member(interview_room, sid, display_name, session[interview_room].get("agent", False))
     
     # broadcast to others in the room
     logger.info("[{}] New member joined: {}<{}>".format(interview_room, display_name, sid))
     emit("peer_connect", {"sid": sid, "name": display_name}, broadcast=True, include_self=False, room=interview_room)
     
-    # add to user list maintained on server
-    if interview_room not in _users_in_room:
-        _users_in_room[interview_room] = [sid]
-        emit("peer_list", {"target_id": sid}) # send own id only  TODO: `peer_list` event will try to reach for `peers`
-        
-        logger.info("Someone entered empty room. Running agent")
-        run_agent_async(interview_room)
-
+    if not members:
+        emit("peer_list", {"target_id": sid, "mode": CALL_MODE}) # send own id only
     else:
-        usrlist = {u_id:_name_of_sid[u_id] for u_id in _users_in_room[interview_room]}
-        emit("peer_list", {"peers": usrlist, "target_id": sid}) # send list of existing users to the new member
-        _users_in_room[interview_room].append(sid) # add new member to user list maintained on server
+        # send list of existing users to the new member
+        emit("peer_list", {"peers": members, "target_id": sid, "mode": CALL_MODE})
+
+    if not session[interview_room].get("agent", False):
+        # does nothing if the room already has an agent (in any backend process)
+        agents.assign(interview_room, session[interview_room].get("proctoring"))
 
-    logger.info(f"\nusers: {_users_in_room}\n")
+    logger.info(f"\n[{interview_room}] users: {rooms.members(interview_room)}\n")
 
 
 @socketio.on("disconnect")
 def on_disconnect():
     sid = request.sid
-    interview_room = _room_of_sid[sid]
-    display_name = _name_of_sid[sid]
+    membership = rooms.remove_member(sid)
+    if membership is None:  # socket has not joined any room
+        return
+    interview_room, display_name, _ = membership
 
     logger.info("[{}] Member left: {}<{}>".format(interview_room, display_name, sid))
     emit("peer_disconnect", {"sid": sid}, broadcast=True, include_self=False, room=interview_room)
 
-    _users_in_room[interview_room].remove(sid)
-    if len(_users_in_room[interview_room]) == 0:
-        _users_in_room.pop(interview_room)
-
-    _room_of_sid.pop(sid)
-    _name_of_sid.pop(sid)
+    if rooms.people(interview_room) == 0:  # only the agent is left
+        agents.release(interview_room)  # agent of another backend process is released by its supervisor
 
-    logger.info(f"\nusers: {_users_in_room}\n")
+    logger.info(f"\n[{interview_room}] users: {rooms.members(interview_room)}\n")
 
 
 @socketio.on("data")
@@ -0,0 +1,191 @@
+from globals import *
+
+from backend.application import application, db, Job
+
+import json
+import logging
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """
+    Local queue of background jobs with a pool of worker threads.
+
+    Jobs are stored in the database, so they survive restarts of the backend.
+    Running job is leased for `lease` seconds and its lease is renewed while the job runs:
+    if its worker dies (e.g. process was restarted), job is picked up again by any worker after the lease expires.
+    Workers are started together with the backend (see `backend.application.run`),
+    so jobs that were left pending or running before a restart do not wait for a new submission.
+    Request handlers only submit jobs and poll their status, so they are never blocked by long jobs (e.g. LLM calls).
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, poll_interval: float = 0.5, lease: float = 600):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+
+        self.handlers = dict()
+
+        self.__threads = []
+        self.__wake_up = threading.Event()
+        self.__lock = threading.Lock()
+
+    def handler(self, kind: str):
+        """
+        Registers handler of the jobs of given kind.
+
+        Handler receives payload of the job (with `job_id` added) and returns JSON-serializable result.
+        Job could be run again if its worker died, so handler should be able to resume it.
+
+        :param kind: Kind of the jobs
+        """
+
+        def decorator(function):
+            self.handlers[kind] = function
+            return function
+
+        return decorator
+
+    def start(self) -> None:
+        """Starts worker threads (does nothing if they are already started)."""
+
+        with self.__lock:
+            if self.__threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.__run, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self.__threads.append(thread)
+
+    def submit(self, kind: str, payload: dict, user_id: int) -> int:
+        """
+        Submits job to the queue.
+
+        :param kind: Kind of the job (should have registered handler)
+        :param payload: JSON-serializable arguments of the job
+        :param user_id: Id of the user that submitted the job
+
+        :returns: Id of the job
+        """
+
+        if kind not in self.handlers:
+            raise KeyError(f"There is no handler for `{kind}` jobs")
+
+        now = time.time()
+        job = Job(
+            user_id=user_id,
+            kind=kind,
+            payload=json.dumps(payload, ensure_ascii=False),
+            status="pending",
+            created_at=now,
+            updated_at=now
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        self.start()
+        self.__wake_up.set()
+        return job.id
+
+    @staticmethod
+    def status(job_id: int) -> dict | None:
+        """
+        Returns status of the job.
+
+        :param job_id: Id of the job
+
+        :returns: Dictionary with `id`, `kind`, `status` (`pending`, `running`, `done` or `failed`),
+                  `result` and `error` or `None` if there is no such job.
+        """
+
+        job = db.session.get(Job, job_id)
+        if job is None:
+            return None
+        return {
+            "id": job.id,
+            "user_id": job.user_id,
+            "kind": job.kind,
+            "status": job.status,
+            "result": json.loads(job.result) if job.result is not None else None,
+            "error": job.error,
+        }
+
+    def __claim(self):
+        """Atomically claims the oldest pending job (or job with expired lease)."""
+
+        now = time.time()
+        candidates = db.session.execute(
+            db.select(Job.id, Job.updated_at)
+            .where((Job.status == "pending") | ((Job.status == "running") & (Job.updated_at < now - self.lease)))
+            .order_by(Job.id)
+            .limit(self.workers)
+        ).all()
+        for job_id, updated_at in candidates:
+            claimed = db.session.execute(
+                db.update(Job)
+                .where(Job.id == job_id, Job.updated_at == updated_at)
+                .values(status="running", updated_at=now)
+            ).rowcount
+            db.session.commit()
+            if claimed == 1:  # nobody else has claimed the job in the meantime
+                return db.session.get(Job, job_id)
+        return None
+
+    def __renew_lease(self, job_id: int, finished: threading.Event) -> None:
+        """Renews lease of the running job until it is finished (long jobs could run longer than `lease`)."""
+
+        while not finished.wait(self.lease / 3):
+            with application.app_context():
+                try:
+                    db.session.execute(
+                        db.update(Job)
+                        .where(Job.id == job_id, Job.status == "running")
+                        .values(updated_at=time.time())
+                    )
+                    db.session.commit()
+                except Exception as e:
+                    logger.error(f"Lease of job #{job_id} was not renewed: {e}")
+                    db.session.rollback()
+
+    def __execute(self, job) -> None:
+        job_id, kind = job.id, job.kind
+        logger.info(f"Running job #{job_id} ({kind})")
+        finished = threading.Event()
+        threading.Thread(target=self.__renew_lease, args=(job_id, finished), daemon=True).start()
+        try:
+            result = self.handlers[kind](json.loads(job.payload) | {"job_id": job_id})
+            job.result = json.dumps(result, ensure_ascii=False)
+            job.status = "done"
+            job.updated_at = time.time()
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"Job #{job_id} ({kind}) failed: {e}\n{traceback.format_exc()}")
+            db.session.rollback()  # session could be left broken by the handler (e.g. failed flush or locked database)
+            job = db.session.get(Job, job_id)
+            job.error = str(e)
+            job.status = "failed"
+            job.updated_at = time.time()
+            db.session.commit()
+        finally:
+            finished.set()
+
+    def __run(self) -> None:
+        while True:
+            with application.app_context():
+                try:
+                    job = self.__claim()
+                    if job is not None:
+                        self.__execute(job)
+                        continue
+                except Exception as e:
+                    logger.error(f"Job queue error: {e}")
+                    db.session.rollback()
+            self.__wake_up.wait(self.poll_interval)
+            self.__wake_up.clear()
+
+
+jobs = JobQueue()
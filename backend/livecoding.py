@@ -0,0 +1,178 @@
+import threading
+
+
+def _transform_component(component: dict, against: dict, wins_tie: bool) -> list[dict]:
+    """
+    Transforms single component of the operation against concurrent component.
+
+    Component either inserts text (`{"position": int, "insert": str}`)
+    or deletes characters (`{"position": int, "delete": int}`).
+    Positions are counted in UTF-16 code units (the same way as in JavaScript).
+
+    :param component: Transformed component
+    :param against: Component that was applied first
+    :param wins_tie: Whether `component` goes first if both components insert at the same position
+
+    :return: Transformed component (deletions could be split in two or vanish)
+    """
+
+    position = component["position"]
+    if "insert" in against:
+        length = _utf16_length(against["insert"])
+        if "insert" in component:
+            if against["position"] < position or (against["position"] == position and not wins_tie):
+                position += length
+            return [{"position": position, "insert": component["insert"]}]
+
+        end = position + component["delete"]
+        if against["position"] <= position:
+            return [{"position": position + length, "delete": component["delete"]}]
+        if against["position"] >= end:
+            return [dict(component)]
+        # text was inserted inside the deleted range - it is kept, and the range is split around it
+        return [
+            {"position": position, "delete": against["position"] - position},
+            {"position": position + length, "delete": end - against["position"]},
+        ]
+
+    against_end = against["position"] + against["delete"]
+    if "insert" in component:
+        if position <= against["position"]:
+            return [dict(component)]
+        if position >= against_end:
+            return [{"position": position - against["delete"], "insert": component["insert"]}]
+        return [{"position": against["position"], "insert": component["insert"]}]
+
+    end = position + component["delete"]
+    if end <= against["position"]:
+        return [dict(component)]
+    if position >= against_end:
+        return [{"position": position - against["delete"], "delete": component["delete"]}]
+    overlap = min(end, against_end) - max(position, against["position"])
+    if component["delete"] == overlap:
+        return []
+    return [{"position": min(position, against["position"]), "delete": component["delete"] - overlap}]
+
+
+def transform(operation: list[dict], against: list[dict], wins_tie: bool) -> (list[dict], list[dict]):
+    """
+    Transforms two concurrent operations (lists of components that are applied one by one) against each other.
+
+    :param operation: First operation
+    :param against: Second operation
+    :param wins_tie: Whether `operation` goes first if both operations insert at the same position
+
+    :return: `operation` that should be applied after `against`
+             and `against` that should be applied after `operation`
+    """
+
+    if not operation or not against:
+        return operation, against
+    if len(operation) > 1:
+        head, against = transform(operation[:1], against, wins_tie)
+        tail, against = transform(operation[1:], against, wins_tie)
+        return head + tail, against
+    if len(against) > 1:
+        head, operation = transform(against[:1], operation, not wins_tie)
+        tail, operation = transform(against[1:], operation, not wins_tie)
+        return operation, head + tail
+    return (_transform_component(operation[0], against[0], wins_tie),
+            _transform_component(against[0], operation[0], not wins_tie))
+
+
+def _utf16_length(text: str) -> int:
+    return len(text.encode("utf-16-le", errors="surrogatepass")) // 2
+
+
+def is_operation(operation) -> bool:
+    """Checks that operation that was received from the client is well-formed."""
+
+    return isinstance(operation, list) and all(
+        isinstance(component, dict)
+        and type(component.get("position")) is int and component["position"] >= 0
+        and (isinstance(component.get("insert"), str)
+             or (type(component.get("delete")) is int and component["delete"] > 0))
+        for component in operation
+    )
+
+
+def apply(text: str, operation: list[dict]) -> str:
+    """Applies operation to the text (positions are clamped to the text)."""
+
+    encoded = text.encode("utf-16-le", errors="surrogatepass")
+    for component in operation:
+        position = 2 * min(component["position"], len(encoded) // 2)
+        if "insert" in component:
+            inserted = component["insert"].encode("utf-16-le", errors="surrogatepass")
+            encoded = encoded[:position] + inserted + encoded[position:]
+        else:
+            encoded = encoded[:position] + encoded[position + 2 * component["delete"]:]
+    return encoded.decode("utf-16-le", errors="surrogatepass")
+
+
+class CodingDocument:
+    """
+    Authoritative state of the live coding editor of one interview room.
+
+    Clients send operations together with the version of the document they were made against.
+    Operations that were made against an older version are transformed against the operations
+    that were applied since (operational transformation), so concurrent edits converge.
+    Only last `max_history` operations are kept; clients that are further behind have to resync with a snapshot.
+
+    `lock` should be held while results of `submit` are broadcast, so clients receive operations in order of versions.
+    """
+
+    def __init__(self, text: str = "", max_history: int = 256):
+        self.text = text
+        self.version = 0
+        self.max_history = max_history
+
+        self.history: list[list[dict]] = []  # last operations (`history[-1]` produced `version`)
+        self.lock = threading.RLock()
+
+    def state(self) -> dict:
+        """Full state of the document (could be stored and restored with `from_state`)."""
+
+        with self.lock:
+            return {"text": self.text, "version": self.version, "history": self.history}
+
+    @staticmethod
+    def from_state(state: dict, max_history: int = 256) -> 'CodingDocument':
+        document = CodingDocument(state["text"], max_history)
+        document.version = state["version"]
+        document.history = state["history"]
+        return document
+
+    def snapshot(self) -> dict:
+        """Current text of the document and its version."""
+
+        with self.lock:
+            return {"code": self.text, "version": self.version}
+
+    def submit(self, operation: list[dict], version: int) -> tuple[list[dict], int] | None:
+        """
+        Applies operation of the client.
+
+        :param operation: Operation of the client
+        :param version: Version of the document that operation was made against
+
+        :return: Transformed operation and new version of the document
+                 or `None` if the operation is malformed or its version is unknown
+                 (client should resync with a snapshot)
+        """
+
+        if not is_operation(operation) or type(version) is not int:
+            return None
+        with self.lock:
+            behind = self.version - version
+            if behind < 0 or behind > len(self.history):
+                return None
+            for applied in self.history[len(self.history) - behind:]:
+                operation, _ = transform(operation, applied, wins_tie=False)
+
+            self.text = apply(self.text, operation)
+            self.version += 1
+            self.history.append(operation)
+            if len(self.history) > self.max_history:
+                self.history = self.history[-self.max_history:]
+            return operation, self.version
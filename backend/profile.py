@@ -1,6 +1,8 @@
 from backend.application import application
 
 from backend.application import db, User
+from backend.evaluation import candidates
+from backend.jobs import jobs
 
 import os
 
@@ -116,6 +118,14 @@ def handle_profile_update(user):
             document_path = os.path.join(application.config["UPLOAD_FOLDER"], folder, document_filepath)
             os.makedirs(os.path.dirname(document_path), exist_ok=True)
             document.save(document_path)
+            if folder == "cvs":
+                if user.document_filepath and user.document_filepath != document_filepath:
+                    # replaced CV should not be shortlisted anymore
+                    previous_path = os.path.join(application.config["UPLOAD_FOLDER"], folder, user.document_filepath)
+                    candidates.remove(previous_path)
+                    if os.path.isfile(previous_path):
+                        os.remove(previous_path)
+                jobs.submit("index_cv", {"cv_path": document_path}, user.id)
 
         user.last_name = form.last_name.data
         user.first_name = form.first_name.data
@@ -0,0 +1,312 @@
+from globals import *
+
+from backend.livecoding import CodingDocument
+
+import contextlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RoomStore:
+    """
+    Storage of the state of interview rooms: members of the rooms (sid, display name and whether it is an agent),
+    live coding documents and claims of the processes that run agents of the rooms (see `AgentManager`).
+
+    Base store keeps the state in the memory of the process, so it works only with a single backend process.
+    Subclasses keep the state outside the process, so several backend processes
+    (behind the load balancer, relaying events through socket.io message queue) share it.
+    """
+
+    def __init__(self):
+        self.__rooms: dict[str, dict[str, str]] = dict()  # room -> (sid -> display name)
+        self.__room_of_sid: dict[str, str] = dict()
+        self.__documents: dict[str, CodingDocument] = dict()
+        self.__agents: set[str] = set()  # sids of the members that are agents
+        self.__agent_rooms: set[str] = set()  # rooms whose agents are claimed
+        self.__lock = threading.Lock()
+
+    def add_member(self, room: str, sid: str, name: str, agent: bool = False) -> dict[str, str]:
+        """
+        Adds member to the room.
+
+        :param room: Name of the room
+        :param sid: Sid of the member
+        :param name: Display name of the member
+        :param agent: Whether member is an agent
+
+        :return: Members of the room before this one has joined (sid -> display name)
+        """
+
+        with self.__lock:
+            members = self.__rooms.setdefault(room, dict())
+            previous_members = dict(members)
+            members[sid] = name
+            self.__room_of_sid[sid] = room
+            if agent:
+                self.__agents.add(sid)
+            else:
+                self.__agents.discard(sid)
+            return previous_members
+
+    def remove_member(self, sid: str) -> tuple[str, str, int] | None:
+        """
+        Removes member from its room (live coding document is dropped when the last member leaves).
+
+        :param sid: Sid of the member
+
+        :return: Name of the room, display name of the member and number of the remaining members
+                 or `None` if member has not joined any room
+        """
+
+        with self.__lock:
+            room = self.__room_of_sid.pop(sid, None)
+            if room is None:
+                return None
+            members = self.__rooms[room]
+            name = members.pop(sid)
+            self.__agents.discard(sid)
+            if not members:
+                self.__rooms.pop(room)
+                self.__documents.pop(room, None)
+            return room, name, len(members)
+
+    def room_of(self, sid: str) -> str | None:
+        with self.__lock:
+            return self.__room_of_sid.get(sid)
+
+    def members(self, room: str) -> dict[str, str]:
+        with self.__lock:
+            return dict(self.__rooms.get(room, dict()))
+
+    def people(self, room: str) -> int:
+        """Number of the members of the room that are not agents."""
+
+        with self.__lock:
+            return sum(sid not in self.__agents for sid in self.__rooms.get(room, dict()))
+
+    def claim_agent(self, room: str) -> bool:
+        """
+        Claims running the agent of the room by this process.
+
+        :param room: Name of the room
+
+        :return: Whether this process should run the agent
+                 (`False` if it is claimed by another process that is still running)
+        """
+
+        with self.__lock:
+            self.__agent_rooms.add(room)
+            return True
+
+    def release_agent(self, room: str) -> None:
+        """Drops the claim of this process on the agent of the room (does nothing if it is claimed by another one)."""
+
+        with self.__lock:
+            self.__agent_rooms.discard(room)
+
+    @contextlib.contextmanager
+    def coding_document(self, room: str):
+        """
+        Locks live coding document of the room (it is created if needed).
+
+        Changes of the document are saved when the block exits,
+        and no other process or thread could access the document inside the block.
+        """
+
+        with self.__lock:
+            document = self.__documents.setdefault(room, CodingDocument())
+        with document.lock:
+            yield document
+
+
+class SQLiteRoomStore(RoomStore):
+    """
+    Store that keeps the state of the rooms in SQLite database,
+    so it is shared by all backend processes on the same host.
+
+    Every operation is a single transaction, so processes see consistent membership
+    (e.g. exactly one of them sees that the room was empty).
+    Every member and claim of the agent is stored with the process that owns it (`host:pid`),
+    and rows of the processes that are no longer running (e.g. crashed ones) are purged on startup,
+    so agents of their rooms could be claimed by other processes.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.host = socket.gethostname()
+        self.owner = f"{self.host}:{os.getpid()}"
+
+        with self.__connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS room_member ("
+                "sid TEXT PRIMARY KEY, "
+                "room TEXT NOT NULL, "
+                "name TEXT NOT NULL, "
+                "joined_at REAL NOT NULL, "
+                "owner TEXT NOT NULL DEFAULT '', "
+                "agent INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(room_member)").fetchall()}
+            for column, definition in [("owner", "TEXT NOT NULL DEFAULT ''"), ("agent", "INTEGER NOT NULL DEFAULT 0")]:
+                if column not in columns:  # database of the older version
+                    connection.execute(f"ALTER TABLE room_member ADD COLUMN {column} {definition}")
+            connection.execute("CREATE INDEX IF NOT EXISTS room_member_room_index ON room_member (room)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS coding_document ("
+                "room TEXT PRIMARY KEY, "
+                "state TEXT NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS room_agent ("
+                "room TEXT PRIMARY KEY, "
+                "owner TEXT NOT NULL)"
+            )
+            self.__purge_stale_owners(connection)
+
+    @staticmethod
+    def __is_running(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:  # process of another user
+            return True
+        return True
+
+    def __is_stale(self, owner: str) -> bool:
+        """Checks whether owner is a process of this host that is no longer running (owners of other hosts are not checked)."""
+
+        host, _, pid = owner.rpartition(":")
+        if host != self.host and owner:
+            return False
+        return not pid.isdigit() or not SQLiteRoomStore.__is_running(int(pid))
+
+    def __purge_stale_owners(self, connection: sqlite3.Connection) -> None:
+        """
+        Removes members and claims of the agents of the processes of this host that are no longer running
+        (and members without owner, written by the older version),
+        and drops live coding documents of the rooms that have no members left.
+        """
+
+        owners = connection.execute("SELECT owner FROM room_member UNION SELECT owner FROM room_agent").fetchall()
+        stale = [owner for (owner,) in owners if owner == self.owner or self.__is_stale(owner)]
+        for owner in stale:
+            connection.execute("DELETE FROM room_member WHERE owner = ?", (owner,))
+            connection.execute("DELETE FROM room_agent WHERE owner = ?", (owner,))
+        connection.execute("DELETE FROM coding_document WHERE room NOT IN (SELECT room FROM room_member)")
+        if stale:
+            logger.warning(f"Purged members and agents of stopped backend processes: {', '.join(o or '?' for o in stale)}")
+
+    def add_member(self, room: str, sid: str, name: str, agent: bool = False) -> dict[str, str]:
+        with self.__connect() as connection:
+            previous_members = dict(connection.execute(
+                "SELECT sid, name FROM room_member WHERE room = ? AND sid != ? ORDER BY joined_at", (room, sid)
+            ).fetchall())
+            connection.execute(
+                "INSERT OR REPLACE INTO room_member (sid, room, name, joined_at, owner, agent) VALUES (?, ?, ?, ?, ?, ?)",
+                (sid, room, name, time.time(), self.owner, int(agent))
+            )
+            return previous_members
+
+    def remove_member(self, sid: str) -> tuple[str, str, int] | None:
+        with self.__connect() as connection:
+            row = connection.execute("SELECT room, name FROM room_member WHERE sid = ?", (sid,)).fetchone()
+            if row is None:
+                return None
+            room, name = row
+            connection.execute("DELETE FROM room_member WHERE sid = ?", (sid,))
+            remaining = connection.execute("SELECT COUNT(*) FROM room_member WHERE room = ?", (room,)).fetchone()[0]
+            if remaining == 0:
+                connection.execute("DELETE FROM coding_document WHERE room = ?", (room,))
+            return room, name, remaining
+
+    def room_of(self, sid: str) -> str | None:
+        with self.__connect(write=False) as connection:
+            row = connection.execute("SELECT room FROM room_member WHERE sid = ?", (sid,)).fetchone()
+            return row[0] if row is not None else None
+
+    def members(self, room: str) -> dict[str, str]:
+        with self.__connect(write=False) as connection:
+            return dict(connection.execute(
+                "SELECT sid, name FROM room_member WHERE room = ? ORDER BY joined_at", (room,)
+            ).fetchall())
+
+    def people(self, room: str) -> int:
+        with self.__connect(write=False) as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM room_member WHERE room = ? AND agent = 0", (room,)
+            ).fetchone()[0]
+
+    def claim_agent(self, room: str) -> bool:
+        with self.__connect() as connection:
+            row = connection.execute("SELECT owner FROM room_agent WHERE room = ?", (room,)).fetchone()
+            if row is not None and row[0] != self.owner and not self.__is_stale(row[0]):
+                return False
+            connection.execute("INSERT OR REPLACE INTO room_agent (room, owner) VALUES (?, ?)", (room, self.owner))
+            return True
+
+    def release_agent(self, room: str) -> None:
+        with self.__connect() as connection:
+            connection.execute("DELETE FROM room_agent WHERE room = ? AND owner = ?", (room, self.owner))
+
+    @contextlib.contextmanager
+    def coding_document(self, room: str):
+        with self.__connect() as connection:
+            row = connection.execute("SELECT state FROM coding_document WHERE room = ?", (room,)).fetchone()
+            document = CodingDocument.from_state(json.loads(row[0])) if row is not None else CodingDocument()
+            version = document.version
+
+            yield document
+
+            if row is None or document.version != version:
+                connection.execute(
+                    "INSERT OR REPLACE INTO coding_document (room, state) VALUES (?, ?)",
+                    (room, json.dumps(document.state(), ensure_ascii=False))
+                )
+
+    @contextlib.contextmanager
+    def __connect(self, write: bool = True) -> sqlite3.Connection:
+        """
+        Connection with an open transaction (committed on success and rolled back on error).
+
+        :param write: Whether transaction takes the write lock right away
+                      (otherwise it is deferred, so reads do not wait for writers of other processes)
+        """
+
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+
+def create_room_store(kind: str = ROOM_STORE, path: str = ROOM_STORE_PATH) -> RoomStore:
+    """
+    Creates store of the state of interview rooms.
+
+    :param kind: Kind of the store (`memory` or `sqlite`)
+    :param path: Path to the database (for `sqlite` store)
+    """
+
+    if kind == "memory":
+        return RoomStore()
+    if kind == "sqlite":
+        return SQLiteRoomStore(path)
+    raise ValueError(f"Unknown room store `{kind}`")
+
+
+rooms = create_room_store()  # stores members and live coding documents of the rooms (could be shared by processes)
@@ -0,0 +1,116 @@
+from globals import *
+
+import sqlalchemy as sa
+
+# Tables that are created on startup (tables of the original schema, `user` and `user_role`, come with `db.sqlite`)
+TABLES: list[str] = [
+    """
+    CREATE TABLE IF NOT EXISTS job
+    (
+        id integer
+            constraint job_pk
+                primary key autoincrement,
+        user_id integer not null
+            references user,
+        kind text not null,
+        payload text not null,
+        status text default 'pending' not null,
+        result text,
+        error text,
+        created_at real not null,
+        updated_at real not null
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS job_status_index ON job (status, id)",
+    """
+    CREATE TABLE IF NOT EXISTS vacancy
+    (
+        id integer
+            constraint vacancy_pk
+                primary key autoincrement,
+        user_id integer not null
+            references user,
+        filepath text not null,
+        created_at real not null
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS requirement
+    (
+        id integer
+            constraint requirement_pk
+                primary key autoincrement,
+        vacancy_id integer not null
+            references vacancy
+                on delete cascade,
+        position integer not null,
+        text text not null
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS requirement_vacancy_index ON requirement (vacancy_id, position)",
+    """
+    CREATE TABLE IF NOT EXISTS evaluation
+    (
+        id integer
+            constraint evaluation_pk
+                primary key autoincrement,
+        vacancy_id integer not null
+            references vacancy
+                on delete cascade,
+        user_id integer not null
+            references user,
+        resume_filepath text not null,
+        average_score real not null,
+        summary_text text not null,
+        created_at real not null
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS evaluation_grade
+    (
+        id integer
+            constraint evaluation_grade_pk
+                primary key autoincrement,
+        evaluation_id integer not null
+            references evaluation
+                on delete cascade,
+        requirement_id integer not null
+            references requirement
+                on delete cascade,
+        score integer not null,
+        justification text
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS evaluation_grade_evaluation_index ON evaluation_grade (evaluation_id)",
+]
+
+# Columns that were added to existing tables: (table, column, definition)
+COLUMNS: list[tuple[str, str, str]] = [
+    ("evaluation", "job_id", "integer references job"),
+]
+
+# Indices on the added columns (created after the columns)
+INDICES: list[str] = [
+    "CREATE INDEX IF NOT EXISTS evaluation_job_index ON evaluation (job_id)",
+]
+
+
+def migrate(engine: sa.Engine) -> None:
+    """
+    Brings schema of the database up to date: creates missing tables and adds missing columns.
+
+    Every step is idempotent, so migration runs on every startup,
+    both on a fresh `db.sqlite` and on databases of the existing deployments.
+
+    :param engine: Engine of the database
+    """
+
+    with engine.begin() as connection:
+        for statement in TABLES:
+            connection.execute(sa.text(statement))
+        for table, column, definition in COLUMNS:
+            columns = {row[1] for row in connection.execute(sa.text(f"PRAGMA table_info({table})")).fetchall()}
+            if column not in columns:
+                connection.execute(sa.text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+        for statement in INDICES:
+            connection.execute(sa.text(statement))
@@ -0,0 +1,58 @@
+from ai.proctoring import AntiCheat
+
+import contextlib
+import io
+import random
+import time
+
+steps = 20000
+window_sizes = [15, 300, 3000, 30000]  # длинное окно в шагах
+states = AntiCheat.STATES + [None]  # None - лицо не найдено
+
+
+class ListAntiCheat:
+    """Прежняя реализация: пересчёт окон через `list.count` и `pop(0)` на каждом шаге."""
+
+    def __init__(self, short_steps: int, long_steps: int):
+        self.short_steps = short_steps
+        self.long_steps = long_steps
+        self.gazes = []
+
+    @staticmethod
+    def most_popular_state(array) -> str:
+        states = dict()
+        states["ups"] = array.count("up")
+        states["downs"] = array.count("down")
+        states["lefts"] = array.count("left")
+        states["rights"] = array.count("right")
+        states["centers"] = array.count("center")
+
+        most_popular = max(states.values())
+        # возвращает первый ключ, значение которого равно most_popular
+        return next((k for k, v in states.items() if v == most_popular), None)
+
+    def step(self, status: str) -> None:
+        self.gazes.append(status)
+        self.most_popular_state(self.gazes[-self.short_steps:])
+        self.most_popular_state(self.gazes[-self.long_steps:])
+        if len(self.gazes) > self.long_steps:
+            self.gazes.pop(0)
+
+
+def per_step(anticheat, statuses: list) -> float:
+    with contextlib.redirect_stdout(io.StringIO()):  # тревоги печатаются на каждом шаге
+        start = time.perf_counter()
+        for status in statuses:
+            anticheat.step(status)
+        return (time.perf_counter() - start) / len(statuses)
+
+
+random.seed(0)
+statuses = [random.choice(states) for _ in range(steps)]
+
+print(f"{'Окно':>8}{'Кольцо, мкс':>14}{'Список, мкс':>14}")
+for long_steps in window_sizes:
+    short_steps = max(1, long_steps // 20)
+    ring = per_step(AntiCheat(short_steps, long_steps, fps=1), statuses)
+    naive = per_step(ListAntiCheat(short_steps, long_steps), statuses)
+    print(f"{long_steps:>8}{ring * 1e6:>14.2f}{naive * 1e6:>14.2f}")
@@ -0,0 +1,68 @@
+from ai.documents import documents
+from ai.evaluation import Evaluator
+from ai.llm import FakeDocumentLLM
+
+import statistics
+import time
+
+vacancy_files = ["tests/VacancyExample1.docx"]
+cv_files = ["tests/Example2.docx"]
+runs = 20
+latency = 0.2  # задержка заглушки LLM, с
+cv_batch = 16  # сколько резюме оценивается параллельно для пропускной способности
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def measure(operation, llm: FakeDocumentLLM) -> (list[float], list[float]):
+    """
+    Полные задержки операции и задержки без учёта времени "внутри модели"
+    (параллельные вызовы модели учитываются один раз, как объединение их интервалов).
+    """
+
+    latencies, overheads = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        operation()
+        end = time.perf_counter()
+        latencies.append(end - start)
+        overheads.append(end - start - llm.model_time_between(start, end))
+    return latencies, overheads
+
+
+def report(name: str, latencies: list[float], overheads: list[float]) -> None:
+    print(f"{name:<24}"
+          f"{statistics.median(latencies) * 1000:>10.1f}"
+          f"{percentile(latencies, 0.99) * 1000:>10.1f}"
+          f"{statistics.median(overheads) * 1000:>14.1f}")
+
+
+llm = FakeDocumentLLM(latency=latency, jitter=latency / 4)
+
+print(f"Заглушка LLM: задержка {latency * 1000:.0f} мс, {runs} повторов")
+print(f"{'Операция':<24}{'p50, мс':>10}{'p99, мс':>10}{'Накладные, мс':>14}")
+
+for filename in vacancy_files + cv_files:
+    parsing = [0.0] * runs
+    for i in range(runs):
+        start = time.perf_counter()
+        documents.extract(filename)
+        parsing[i] = time.perf_counter() - start
+    report(f"Разбор {filename.split('/')[-1]}", parsing, parsing)
+
+for vacancy_file in vacancy_files:
+    report("from_vacancy_file", *measure(lambda: Evaluator.from_vacancy_file(vacancy_file, False, llm), llm))
+    evaluator = Evaluator.from_vacancy_file(vacancy_file, llm=llm)
+    for cv_file in cv_files:
+        report("grade", *measure(lambda: evaluator.grade(cv_file=cv_file), llm))
+
+    batch = [cv_files[i % len(cv_files)] for i in range(cv_batch)]
+    start = time.perf_counter()
+    failures = sum(error is not None for _, _, error in evaluator.grade_many(batch))
+    elapsed = time.perf_counter() - start
+    print(f"grade_many: {cv_batch / elapsed:.2f} резюме/с ({failures} ошибок)")
+
+print(f"Вызовов LLM: {llm.calls}, из них неудачных: {llm.failures}")
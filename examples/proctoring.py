@@ -0,0 +1,15 @@
+from ai.models import models, FACE_MESH
+from ai.proctoring import Proctor, ProctoringProfile
+
+from PIL import Image
+
+image_file_name = "tests/ProctoringExample1.jpg"
+
+profile = ProctoringProfile()
+profile.warm_up()  # модели профиля (в том числе ONNX/OpenVINO) загружаются до первого кадра
+models.warm_up([FACE_MESH])
+proctors = [Proctor(profile) for _ in range(4)]  # модели загружаются только один раз
+for name, metrics in models.metrics.items():
+    print(f"{name}: загружена за {metrics['load_time']:.2f} с, {metrics['memory'] / 2 ** 20:.1f} МБ")
+
+print(proctors[0].analyze(Image.open(image_file_name), 0))
@@ -0,0 +1,43 @@
+from ai.models import InferenceBackend, models
+from ai.proctoring import Proctor, ProctoringProfile
+
+import glob
+import time
+
+from PIL import Image
+
+images_pattern = "tests/proctoring/*.jpg"
+repeats = 5
+
+images = [Image.open(filename) for filename in sorted(glob.glob(images_pattern))]
+if not images:
+    raise FileNotFoundError(f"Нет изображений {images_pattern}")
+
+
+def run(backend: InferenceBackend) -> (float, list[dict]):
+    proctor = Proctor(ProctoringProfile(backend=backend))
+    detections = proctor.detect_batch(images)  # прогрев и результаты для сравнения
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for image in images:
+            proctor.detect_batch([image])
+    return (time.perf_counter() - start) / (repeats * len(images)), detections
+
+
+reference_latency, reference = run(InferenceBackend.PYTORCH)
+print(f"{'Бэкенд':<12}{'мс/кадр':>10}{'Ускорение':>12}{'Совпадение':>12}")
+print(f"{InferenceBackend.PYTORCH.value:<12}{reference_latency * 1000:>10.1f}{1:>12.2f}{1:>12.0%}")
+
+for backend in [InferenceBackend.ONNX, InferenceBackend.ONNX_INT8, InferenceBackend.OPENVINO]:
+    latency, detections = run(backend)
+    fallbacks = [metrics["fallback"] for name, metrics in models.metrics.items()
+                 if name.endswith(f"@{backend.value}") and "fallback" in metrics]
+    if fallbacks:  # otherwise PyTorch would be compared with itself
+        print(f"{backend.value:<12}недоступен: {fallbacks[0]}")
+        continue
+    matches = sum(d == r for d, r in zip(detections, reference)) / len(reference)
+    print(f"{backend.value:<12}{latency * 1000:>10.1f}{reference_latency / latency:>12.2f}{matches:>12.0%}")
+    for filename, d, r in zip(sorted(glob.glob(images_pattern)), detections, reference):
+        if d != r:
+            print(f"    Расхождение на {filename}: {d} (PyTorch: {r})")
@@ -0,0 +1,60 @@
+from ai.proctoring import Proctor, ProctoringProfile, ModelTier
+
+import time
+
+import cv2
+
+clip_file_name = "tests/ProctoringClip.mp4"
+frame_step = 10  # анализируем каждый 10-й кадр
+max_frames = 100
+batch_size = 4
+imgsz_values = [320, 480, 640]
+
+
+def read_clip(filename: str) -> list:
+    frames = []
+    capture = cv2.VideoCapture(filename)
+    index = 0
+    while len(frames) < max_frames:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        if index % frame_step == 0:
+            frames.append(frame)  # YOLO принимает BGR массивы напрямую
+        index += 1
+    capture.release()
+    if not frames:
+        raise FileNotFoundError(f"Не удалось прочитать {filename}")
+    return frames
+
+
+def detect(profile: ProctoringProfile, frames: list) -> (float, list[dict]):
+    proctor = Proctor(profile)
+    proctor.detect_batch(frames[:1])  # прогрев
+
+    detections = []
+    start = time.perf_counter()
+    for i in range(0, len(frames), batch_size):
+        detections.extend(proctor.detect_batch(frames[i:i + batch_size]))
+    return len(frames) / (time.perf_counter() - start), detections
+
+
+def agreement(detections: list[dict], reference: list[dict], key: str) -> float:
+    return sum(d[key] == r[key] for d, r in zip(detections, reference)) / len(reference)
+
+
+frames = read_clip(clip_file_name)
+print(f"Кадров: {len(frames)} ({clip_file_name})")
+
+reference_profile = ProctoringProfile(ModelTier.X, max(imgsz_values))
+_, reference = detect(reference_profile, frames)
+
+print(f"{'Профиль':<14}{'FPS':>8}{'Люди':>8}{'Телефон':>10}")
+for tier in ModelTier:
+    for imgsz in imgsz_values:
+        profile = ProctoringProfile(tier, imgsz)
+        fps, detections = detect(profile, frames)
+        print(f"{repr(profile):<14}{fps:>8.2f}"
+              f"{agreement(detections, reference, 'people_count'):>8.0%}"
+              f"{agreement(detections, reference, 'phone_detected'):>10.0%}")
+print(f"Согласие считается относительно профиля {reference_profile!r}")
@@ -1,5 +1,6 @@
 var myID;
 var _peer_list = {};
+var callMode = "mesh"; // "mesh": members connect to each other, "sfu": members connect only to the agent that forwards streams
 
 // socketio 
 var protocol = window.location.protocol;
@@ -58,6 +59,7 @@ socket.on("peer_disconnect", (data)=>{
 socket.on("peer_list", (data)=>{
     console.log("user list recvd ", data);
     myID = data["target_id"];
+    callMode = data["mode"] || "mesh";
     if( "peers" in data) // not the first to connect to room, existing user list recieved
     {
         let recvd_list = data["peers"];  
@@ -68,7 +70,10 @@ socket.on("peer_list", (data)=>{
             _peer_list[peer_id] = undefined;
             addVideoElement(peer_id, display_name);
         } 
-        start_webrtc();
+        if(callMode === "mesh") // in sfu mode the agent sends offers itself
+        {
+            start_webrtc();
+        }
     }
 });
 
@@ -154,8 +159,11 @@ function createPeerConnection(peer_id)
     _peer_list[peer_id] = new RTCPeerConnection(PC_CONFIG);
 
     _peer_list[peer_id].onicecandidate = (event) => {handleICECandidateEvent(event, peer_id)};
-    _peer_list[peer_id].ontrack = (event) => {handleTrackEvent(event, peer_id)};
-    _peer_list[peer_id].onnegotiationneeded = () => {handleNegotiationNeededEvent(peer_id)};
+    if(callMode === "mesh") // in sfu mode tracks are attached by `attachForwardedTracks` and only the agent offers
+    {
+        _peer_list[peer_id].ontrack = (event) => {handleTrackEvent(event, peer_id)};
+        _peer_list[peer_id].onnegotiationneeded = () => {handleNegotiationNeededEvent(peer_id)};
+    }
 }
 
 
@@ -181,12 +189,25 @@ function handleOfferMsg(msg)
 
     console.log(`offer recieved from <${peer_id}>`);
     
-    createPeerConnection(peer_id);
+    if(!_peer_list[peer_id]) // otherwise the connection is renegotiated (e.g. agent forwards tracks of a new member)
+    {
+        createPeerConnection(peer_id);
+    }
     let desc = new RTCSessionDescription(msg['sdp']);
     _peer_list[peer_id].setRemoteDescription(desc)
     .then(()=>{
         let local_stream = myVideo.srcObject;
-        local_stream.getTracks().forEach((track)=>{_peer_list[peer_id].addTrack(track, local_stream);});
+        let senders = _peer_list[peer_id].getSenders();
+        local_stream.getTracks().forEach((track)=>{
+            if(!senders.some((sender)=>sender.track === track))
+            {
+                _peer_list[peer_id].addTrack(track, local_stream);
+            }
+        });
+        if("tracks" in msg && callMode === "sfu")
+        {
+            attachForwardedTracks(peer_id, msg["tracks"]);
+        }
     })
     .then(()=>{return _peer_list[peer_id].createAnswer();})
     .then((answer)=>{return _peer_list[peer_id].setLocalDescription(answer);})
@@ -241,4 +262,36 @@ function handleTrackEvent(event, peer_id)
     {
         getVideoObj(peer_id).srcObject = event.streams[0];
     }
-}
\ No newline at end of file
+}
+
+// In sfu mode the agent forwards tracks of other members, `tracks` maps `mid` of every transceiver to the member
+function attachForwardedTracks(peer_id, tracks)
+{
+    let streams = {};
+    _peer_list[peer_id].getTransceivers().forEach((transceiver)=>{
+        let member_id = tracks[transceiver.mid];
+        if(member_id === undefined)
+        {
+            return;
+        }
+        if(!(member_id in streams))
+        {
+            streams[member_id] = new MediaStream();
+        }
+        streams[member_id].addTrack(transceiver.receiver.track);
+    });
+
+    for(let member_id in streams)
+    {
+        let video = getVideoObj(member_id);
+        if(!video)
+        {
+            continue;
+        }
+        let trackIds = (stream)=>stream.getTracks().map((track)=>track.id).sort().join();
+        if(!video.srcObject || trackIds(video.srcObject) !== trackIds(streams[member_id]))
+        {
+            video.srcObject = streams[member_id];
+        }
+    }
+}
@@ -1,8 +1,193 @@
+// Live coding editor of the interview room.
+// Edits are sent to the server as operations (lists of `{position, insert}` and `{position, delete}` components,
+// positions are counted in UTF-16 code units) together with the version of the server document they were made against.
+// Only one operation is in flight at a time, and remote operations are transformed against local edits
+// (the same way as on the server, see `backend/livecoding.py`).
+
+function transformComponent(component, against, winsTie) {
+    const position = component.position;
+    if ("insert" in against) {
+        const length = against.insert.length;
+        if ("insert" in component) {
+            const shifted = against.position < position || (against.position === position && !winsTie);
+            return [{position: shifted ? position + length : position, insert: component.insert}];
+        }
+
+        const end = position + component.delete;
+        if (against.position <= position) {
+            return [{position: position + length, delete: component.delete}];
+        }
+        if (against.position >= end) {
+            return [Object.assign({}, component)];
+        }
+        return [
+            {position: position, delete: against.position - position},
+            {position: position + length, delete: end - against.position},
+        ];
+    }
+
+    const againstEnd = against.position + against.delete;
+    if ("insert" in component) {
+        if (position <= against.position) {
+            return [Object.assign({}, component)];
+        }
+        if (position >= againstEnd) {
+            return [{position: position - against.delete, insert: component.insert}];
+        }
+        return [{position: against.position, insert: component.insert}];
+    }
+
+    const end = position + component.delete;
+    if (end <= against.position) {
+        return [Object.assign({}, component)];
+    }
+    if (position >= againstEnd) {
+        return [{position: position - against.delete, delete: component.delete}];
+    }
+    const overlap = Math.min(end, againstEnd) - Math.max(position, against.position);
+    if (component.delete === overlap) {
+        return [];
+    }
+    return [{position: Math.min(position, against.position), delete: component.delete - overlap}];
+}
+
+// Returns `[operation, against]` that should be applied after `against` and after `operation` respectively
+function transform(operation, against, winsTie) {
+    if (operation.length === 0 || against.length === 0) {
+        return [operation, against];
+    }
+    if (operation.length > 1) {
+        const [head, against1] = transform(operation.slice(0, 1), against, winsTie);
+        const [tail, against2] = transform(operation.slice(1), against1, winsTie);
+        return [head.concat(tail), against2];
+    }
+    if (against.length > 1) {
+        const [head, operation1] = transform(against.slice(0, 1), operation, !winsTie);
+        const [tail, operation2] = transform(against.slice(1), operation1, !winsTie);
+        return [operation2, head.concat(tail)];
+    }
+    return [
+        transformComponent(operation[0], against[0], winsTie),
+        transformComponent(against[0], operation[0], !winsTie),
+    ];
+}
+
+function applyOperation(text, operation) {
+    for (const component of operation) {
+        const position = Math.min(component.position, text.length);
+        if ("insert" in component) {
+            text = text.slice(0, position) + component.insert + text.slice(position);
+        } else {
+            text = text.slice(0, position) + text.slice(position + component.delete);
+        }
+    }
+    return text;
+}
+
+function isHighSurrogate(code) {
+    return code >= 0xD800 && code <= 0xDBFF;
+}
+
+// Operation that turns `oldText` into `newText` (single replaced range between common prefix and suffix)
+function diff(oldText, newText) {
+    let prefix = 0;
+    const maxPrefix = Math.min(oldText.length, newText.length);
+    while (prefix < maxPrefix && oldText.charCodeAt(prefix) === newText.charCodeAt(prefix)) {
+        prefix++;
+    }
+    if (prefix > 0 && isHighSurrogate(oldText.charCodeAt(prefix - 1))) {
+        prefix--;  // do not split surrogate pairs
+    }
+
+    let suffix = 0;
+    const maxSuffix = maxPrefix - prefix;
+    while (suffix < maxSuffix
+           && oldText.charCodeAt(oldText.length - 1 - suffix) === newText.charCodeAt(newText.length - 1 - suffix)) {
+        suffix++;
+    }
+    if (suffix > 0 && isHighSurrogate(oldText.charCodeAt(oldText.length - 1 - suffix))) {
+        suffix--;
+    }
+
+    const operation = [];
+    if (oldText.length - prefix - suffix > 0) {
+        operation.push({position: prefix, delete: oldText.length - prefix - suffix});
+    }
+    if (newText.length - prefix - suffix > 0) {
+        operation.push({position: prefix, insert: newText.slice(prefix, newText.length - suffix)});
+    }
+    return operation;
+}
+
+// Appends components to the operation, merging them with the last one when user keeps typing or erasing
+function compose(operation, components) {
+    for (const component of components) {
+        const last = operation[operation.length - 1];
+        if (last && "insert" in last && "insert" in component
+            && component.position === last.position + last.insert.length) {
+            last.insert += component.insert;
+        } else if (last && "delete" in last && "delete" in component
+                   && (component.position === last.position
+                       || component.position + component.delete === last.position)) {
+            last.position = component.position;
+            last.delete += component.delete;
+        } else {
+            operation.push(Object.assign({}, component));
+        }
+    }
+    return operation;
+}
+
+function transformCursor(cursor, operation) {
+    for (const component of operation) {
+        if (component.position >= cursor) {
+            continue;
+        }
+        if ("insert" in component) {
+            cursor += component.insert.length;
+        } else {
+            cursor -= Math.min(component.delete, cursor - component.position);
+        }
+    }
+    return cursor;
+}
+
 document.addEventListener("DOMContentLoaded", function() {
     const editor = document.getElementById("code-editor");
     const status = document.getElementById("status");
 
+    let synced = false;  // whether snapshot of the server document was received
+    let version = 0;  // version of the server document that `shadow` is based on
+    let shadow = "";  // server document with `inflight` operation applied
+    let inflight = null;  // operation that was sent, but was not acknowledged yet
+    let buffer = [];  // local edits that were not sent yet (`editor.value` is `shadow` with `buffer` applied)
+    let lastValue = editor.value;  // value of the editor after the last known edit
+
+    function setText(text, operation) {
+        const scrollPosition = editor.scrollTop;
+        const selectionStart = operation ? transformCursor(editor.selectionStart, operation) : editor.selectionStart;
+        const selectionEnd = operation ? transformCursor(editor.selectionEnd, operation) : editor.selectionEnd;
+
+        editor.value = text;
+        lastValue = text;
+
+        editor.selectionStart = selectionStart;
+        editor.selectionEnd = selectionEnd;
+        editor.scrollTop = scrollPosition;
+    }
+
+    function flush() {
+        if (!synced || inflight !== null || buffer.length === 0) {
+            return;
+        }
+        inflight = buffer;
+        buffer = [];
+        shadow = applyOperation(shadow, inflight);
+        socket.emit("coding_field_update", {ops: inflight, version: version});
+    }
+
     socket.on("disconnect", function() {
+        synced = false;
         status.textContent = "Disconnected from server";
     });
 
@@ -11,28 +196,49 @@ document.addEventListener("DOMContentLoaded", function() {
         status.textContent = "Connection error";
     });
 
-    socket.on("coding_field_update", function(data) {
+    socket.on("coding_field_snapshot", function(data) {
+        synced = true;
+        version = data.version;
+        shadow = data.code;
+        inflight = null;
+        buffer = [];
         if (data.code !== editor.value) {
-            const cursorPosition = editor.selectionStart;
-            const scrollPosition = editor.scrollTop;
-            
-            editor.value = data.code;
-            
-            editor.selectionStart = cursorPosition;
-            editor.selectionEnd = cursorPosition;
-            editor.scrollTop = scrollPosition;
+            setText(data.code, null);
         }
     });
 
+    socket.on("coding_field_ack", function(data) {
+        version = data.version;
+        inflight = null;
+        flush();
+    });
+
+    socket.on("coding_field_update", function(data) {
+        if (!synced || data.version <= version) {
+            return;
+        }
+
+        let remote = data.ops;
+        if (inflight !== null) {
+            [remote, inflight] = transform(remote, inflight, true);
+        }
+        shadow = applyOperation(shadow, remote);
+        [remote, buffer] = transform(remote, buffer, true);
+        version = data.version;
+        setText(applyOperation(editor.value, remote), remote);
+    });
+
     let timeout = null;
     editor.addEventListener("input", function() {
+        // every input event is a single local change, so it is found precisely by the diff with the previous value
+        compose(buffer, diff(lastValue, editor.value));
+        lastValue = editor.value;
+
         clearTimeout(timeout);
-        timeout = setTimeout(function() {
-            socket.emit("coding_field_update", { code: editor.value });
-        }, 100);
+        timeout = setTimeout(flush, 100);
     });
 
     socket.on("user_count", function(data) {
         status.textContent = `Connected users: ${data.count}`;
     });
-});
\ No newline at end of file
+});
@@ -4,4 +4,30 @@ SECRETS: dict[str, str] = dotenv.dotenv_values()
 
 DEBUG: bool = True
 HOST: str = "127.0.0.1"
-PORT: int = 5000
\ No newline at end of file
+PORT: int = 5000
+HEADLESS: bool = SECRETS.get("HEADLESS", "false").lower() == "true"  # agent does not show video windows
+
+# Signalling (several backend processes need shared room store and socket.io message queue, e.g. `redis://`)
+ROOM_STORE: str = SECRETS.get("ROOM_STORE", "memory")  # memory or sqlite
+ROOM_STORE_PATH: str = SECRETS.get("ROOM_STORE_PATH", "backend/rooms.sqlite")
+SOCKETIO_MESSAGE_QUEUE: str | None = SECRETS.get("SOCKETIO_MESSAGE_QUEUE")  # redis://host:6379/0 (kombu is needed for other brokers)
+
+# Agents
+AGENT_WORKERS: int = int(SECRETS.get("AGENT_WORKERS", 2))  # processes of the agent pool
+AGENT_NAME: str = SECRETS.get("AGENT_NAME", "Agent")  # display name of the agent in the interview room
+CALL_MODE: str = SECRETS.get("CALL_MODE", "mesh")  # mesh (peers connect to each other) or sfu (through the agent)
+
+PROCTORING: bool = SECRETS.get("PROCTORING", "true").lower() == "true"  # agents run proctoring models on video
+# Proctoring profile of the deployment (could be overridden for each interview room)
+PROCTORING_TIER: str = SECRETS.get("PROCTORING_TIER", "x")  # nano, small, medium or x
+PROCTORING_IMGSZ: int = int(SECRETS.get("PROCTORING_IMGSZ", 640))
+PROCTORING_BACKEND: str = SECRETS.get("PROCTORING_BACKEND", "pytorch")  # pytorch, onnx, onnx-int8 or openvino
+
+# Evaluation
+EVALUATOR_BACKEND: str = SECRETS.get("EVALUATOR_BACKEND", "mistral")  # mistral or fake (local stand-in, see `ai/llm.py`)
+EVALUATION_CACHE_PATH: str = SECRETS.get("EVALUATION_CACHE_PATH", "ai/cache.sqlite")
+JOB_WORKERS: int = int(SECRETS.get("JOB_WORKERS", 2))  # background workers of the backend
+EVALUATION_MAX_IN_FLIGHT: int = int(SECRETS.get("EVALUATION_MAX_IN_FLIGHT", 4))  # concurrent requests to LLM
+EVALUATION_TOKEN_BUDGET: int = int(SECRETS.get("EVALUATION_TOKEN_BUDGET", 16_000))  # tokens per request to LLM
+MAX_DOCUMENT_PAGES: int = int(SECRETS.get("MAX_DOCUMENT_PAGES", 30))
+MAX_DOCUMENT_CHARACTERS: int = int(SECRETS.get("MAX_DOCUMENT_CHARACTERS", 100_000))